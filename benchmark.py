@@ -0,0 +1,630 @@
+# -*- encoding: utf-8 -*-
+
+import argparse, time, json, os, re, sys, shutil, tempfile, platform, subprocess, itertools, warnings, tracemalloc, pickle, gc
+from xml.sax.saxutils import quoteattr
+from jinja2 import Template
+import transformateur
+
+# Synthetic models.
+synthetic_defaults = {
+    'classes'       : 10,
+    'attributes'    : 10, # Per class.
+    'operations'    : 5, # Per class.
+    'depth'         : 3, # Length of the inheritance chains.
+    'state_machines': 2,
+    'states'        : 10, # Per state machine.
+    'transitions'   : 30, # Per state machine.
+    'instances'     : 100
+}
+fsm_sweep = { # State machine heavy models: many classes sharing a few large state machines.
+    'classes'       : [50],
+    'attributes'    : [5],
+    'operations'    : [2],
+    'depth'         : [3],
+    'state_machines': [2],
+    'states'        : [100, 500],
+    'transitions'   : [1000, 5000],
+    'instances'     : [10]
+}
+primitive_types = ['Integer', 'Real', 'String', 'Boolean']
+primitive_values = {'Integer': '1', 'Real': '1.0', 'String': 'name', 'Boolean': 'true'}
+primitive_href = 'http://www.omg.org/spec/UML/20131001/PrimitiveTypes.xmi#//%s'
+
+# Write a GenMyModel like XMI file, every element carrying its xmi:Extension, with the global, experiment, meta_model and instanciation packages.
+class SyntheticXmiWriter:
+    def __init__(self, fout):
+        self.fout = fout
+        self.depth = 0
+
+    def open(self, tag_name, attributes, properties = {}):
+        self.fout.write('%s<%s %s>\n' % ('  ' * self.depth, tag_name, ' '.join('%s=%s' % (key, quoteattr(str(value))) for key, value in attributes.items())))
+        self.depth += 1
+        if 'xmi:id' in attributes:
+            self.extension(attributes['xmi:id'], properties)
+
+    def close(self, tag_name):
+        self.depth -= 1
+        self.fout.write('%s</%s>\n' % ('  ' * self.depth, tag_name))
+
+    def element(self, tag_name, attributes, properties = {}):
+        if 'xmi:id' in attributes:
+            self.open(tag_name, attributes, properties)
+            self.close(tag_name)
+        else:
+            self.fout.write('%s<%s %s/>\n' % ('  ' * self.depth, tag_name, ' '.join('%s=%s' % (key, quoteattr(str(value))) for key, value in attributes.items())))
+
+    def extension(self, element_id, properties):
+        indent = '  ' * self.depth
+        self.fout.write(f'{indent}<xmi:Extension extender="http://www.eclipse.org/emf/2002/Ecore">\n{indent}  <eAnnotations xmi:id="{element_id}0" source="genmymodel">\n')
+        for i_detail, (key, value) in enumerate([('uuid', element_id)] + list(properties.items())):
+            self.fout.write('%s    <details xmi:id="%s0%d" key=%s value=%s/>\n' % (indent, element_id, i_detail, quoteattr(key), quoteattr(value)))
+        self.fout.write(f'{indent}  </eAnnotations>\n{indent}</xmi:Extension>\n')
+
+    def attribute(self, attribute_id, name, attribute_type, is_list = False, default_value = None):
+        self.open('ownedAttribute', {'xmi:id': attribute_id, 'name': name, 'visibility': 'public'})
+        self.element('type', {'xsi:type': 'uml:PrimitiveType', 'href': primitive_href % attribute_type})
+        if is_list:
+            self.element('lowerValue', {'xsi:type': 'uml:LiteralInteger', 'xmi:id': f'{attribute_id}_l'})
+            self.element('upperValue', {'xsi:type': 'uml:LiteralUnlimitedNatural', 'xmi:id': f'{attribute_id}_u', 'value': '*'})
+        elif default_value is not None:
+            self.element('defaultValue', {'xsi:type': 'uml:LiteralString', 'xmi:id': f'{attribute_id}_d', 'value': default_value})
+        self.close('ownedAttribute')
+
+    def operation(self, operation_id, name, class_id, return_type = None, parameters = []):
+        self.open('ownedOperation', {'xmi:id': operation_id, 'name': name, 'class': class_id})
+        for i_param, parameter_type in enumerate(parameters):
+            self.open('ownedParameter', {'xmi:id': f'{operation_id}_p{i_param}', 'name': f'p{i_param}', 'isUnique': 'false'})
+            self.element('type', {'xsi:type': 'uml:PrimitiveType', 'href': primitive_href % parameter_type})
+            self.close('ownedParameter')
+        if return_type:
+            self.open('ownedParameter', {'xmi:id': f'{operation_id}_r', 'name': 'returnParameter', 'isUnique': 'false', 'direction': 'return'})
+            self.element('type', {'xsi:type': 'uml:PrimitiveType', 'href': primitive_href % return_type})
+            self.close('ownedParameter')
+        self.close('ownedOperation')
+
+def writeSyntheticXmi(fout, config):
+    writer = SyntheticXmiWriter(fout)
+    fout.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    writer.open('xmi:XMI', {'xmi:version': '2.1', 'xmlns:xmi': 'http://schema.omg.org/spec/XMI/2.1', 'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance', 'xmlns:uml': 'http://www.eclipse.org/uml2/5.0.0/UML'})
+    writer.open('uml:Model', {'xmi:id': '_model', 'name': 'synthetic'})
+    # Global.
+    writer.open('packagedElement', {'xsi:type': 'uml:Package', 'xmi:id': '_global_package', 'name': 'global'})
+    writer.open('packagedElement', {'xsi:type': 'uml:Class', 'xmi:id': '_global', 'name': 'global'})
+    writer.attribute('_global_a0', 'nb_agents', 'Integer', default_value='100')
+    writer.attribute('_global_a1', 'agent_speed', 'Real', default_value='1.0')
+    writer.operation('_global_o0', 'init', '_global')
+    writer.close('packagedElement')
+    writer.close('packagedElement')
+    # Experiment.
+    writer.open('packagedElement', {'xsi:type': 'uml:Package', 'xmi:id': '_experiment_package', 'name': 'experiment'})
+    writer.open('packagedElement', {'xsi:type': 'uml:Class', 'xmi:id': '_experiment', 'name': 'synthetic_experiment'}, {'type': 'gui'})
+    writer.attribute('_experiment_a0', 'cycles', 'Integer', default_value='1000')
+    writer.open('ownedOperation', {'xmi:id': '_experiment_o0', 'name': 'main_display', 'class': '_experiment'})
+    writer.element('ownedParameter', {'xmi:id': '_experiment_o0_r', 'name': 'returnParameter', 'type': '_display', 'isUnique': 'false', 'direction': 'return'})
+    writer.close('ownedOperation')
+    writer.close('packagedElement')
+    writer.element('packagedElement', {'xsi:type': 'uml:Class', 'xmi:id': '_display', 'name': 'display', 'isAbstract': 'true'})
+    writer.close('packagedElement')
+    # Species, their inheritance chains and their state machines.
+    writer.open('packagedElement', {'xsi:type': 'uml:Package', 'xmi:id': '_meta_model_package', 'name': 'meta_model'})
+    for i_class in range(config['classes']):
+        class_id = f'_c{i_class}'
+        writer.open('packagedElement', {'xsi:type': 'uml:Class', 'xmi:id': class_id, 'name': f'species{i_class}'}, {'skills': 'moving'} if i_class % 2 else {})
+        if i_class % config['depth']:
+            writer.element('generalization', {'xmi:id': f'{class_id}_g', 'general': f'_c{i_class - 1}'})
+        for i_attribute in range(config['attributes']):
+            attribute_type = primitive_types[i_attribute % len(primitive_types)]
+            default_value = primitive_values[attribute_type] if i_attribute % 3 == 0 else None
+            writer.attribute(f'{class_id}_a{i_attribute}', f'attribute{i_class}_{i_attribute}', attribute_type, i_attribute % 5 == 4, default_value)
+        for i_operation in range(config['operations']):
+            writer.operation(f'{class_id}_o{i_operation}', f'operation{i_operation}', class_id, 'Real' if i_operation % 2 else None, ['Integer', 'Real'][:i_operation % 3])
+        writer.close('packagedElement')
+    for i_machine in range(config['state_machines']):
+        machine_id = f'_m{i_machine}'
+        writer.open('packagedElement', {'xsi:type': 'uml:Package', 'xmi:id': f'{machine_id}_package', 'name': f'behavior{i_machine}'}, {'behavior': ''})
+        writer.open('packagedElement', {'xsi:type': 'uml:StateMachine', 'xmi:id': machine_id, 'name': 'StateMachine'})
+        writer.open('region', {'xmi:id': f'{machine_id}_r', 'name': 'region', 'stateMachine': machine_id})
+        states = max(config['states'], 2)
+        for i_transition in range(config['transitions']):
+            transition_id = f'{machine_id}_t{i_transition}'
+            writer.open('transition', {'xmi:id': transition_id, 'name': '', 'guard': f'{transition_id}_g', 'source': f'{machine_id}_s{i_transition % (states - 1)}', 'target': f'{machine_id}_s{(i_transition * 7 + 1) % states}'}, {'operation0': ''} if i_transition % 4 == 0 else {})
+            writer.open('ownedRule', {'xmi:id': f'{transition_id}_g', 'context': transition_id})
+            writer.element('specification', {'xsi:type': 'uml:LiteralString', 'xmi:id': f'{transition_id}_v', 'value': f'cycle mod {i_transition + 2} = 0'})
+            writer.close('ownedRule')
+            writer.close('transition')
+        for i_state in range(states):
+            state_type, state_name = 'uml:State', f'State{i_state}'
+            if i_state == 0:
+                state_type, state_name = 'uml:Pseudostate', transformateur.UmlState.initial_state_name
+            elif i_state == states - 1:
+                state_type, state_name = 'uml:FinalState', transformateur.UmlState.final_state_name
+            writer.element('subvertex', {'xsi:type': state_type, 'xmi:id': f'{machine_id}_s{i_state}', 'name': state_name}, {'operation0': '', 'operation1': ''} if i_state % 2 == 0 else {'operation0': ''})
+        writer.close('region')
+        writer.close('packagedElement')
+        writer.close('packagedElement')
+    for i_class in range(config['classes'] if config['state_machines'] else 0):
+        writer.element('packagedElement', {'xsi:type': 'uml:Dependency', 'xmi:id': f'_d{i_class}', 'client': f'_c{i_class}', 'supplier': f'_m{i_class % config["state_machines"]}_package'})
+    writer.close('packagedElement')
+    # Instances, valued with the attributes of their class.
+    writer.open('packagedElement', {'xsi:type': 'uml:Package', 'xmi:id': '_instanciation_package', 'name': 'instanciation'})
+    for i_instance in range(config['instances']):
+        instance_id = f'_i{i_instance}'
+        i_class = i_instance % config['classes']
+        writer.open('packagedElement', {'xsi:type': 'uml:InstanceSpecification', 'xmi:id': instance_id, 'name': f'instance{i_instance}', 'classifier': f'_c{i_class}'}, {'priority': str(i_instance % 3)} if i_instance % 2 else {})
+        for i_attribute in range(min(config['attributes'], 4)):
+            writer.open('slot', {'xmi:id': f'{instance_id}_s{i_attribute}', 'definingFeature': f'_c{i_class}_a{i_attribute}', 'owningInstance': instance_id})
+            writer.element('value', {'xsi:type': 'uml:Expression', 'xmi:id': f'{instance_id}_v{i_attribute}', 'symbol': 'nb_agents' if i_attribute == 0 else str(i_instance)})
+            writer.close('slot')
+        writer.close('packagedElement')
+    writer.close('packagedElement')
+    writer.close('uml:Model')
+    writer.close('xmi:XMI')
+
+# Operations json file matching writeSyntheticXmi.
+def syntheticOperations(config):
+    operations = {
+        'global': {'init': 'write "synthetic model";'},
+        'synthetic_experiment': {'main_display': 'display main { }'}
+    }
+    for i_class in range(config['classes']):
+        operations[f'species{i_class}'] = {f'operation{i_operation}': 'return 1.0;' if i_operation % 2 else 'write name;' for i_operation in range(config['operations'])}
+    return operations
+
+def generateSyntheticModel(directory, config, model_name = 'synthetic'):
+    xmi_file_path = os.path.join(directory, f'{model_name}.xmi')
+    json_file_path = os.path.join(directory, f'{model_name}.json')
+    with open(xmi_file_path, 'w', encoding='utf-8') as fout:
+        writeSyntheticXmi(fout, config)
+    with open(json_file_path, 'w', encoding='utf-8') as fout:
+        json.dump(syntheticOperations(config), fout, indent=4)
+    return xmi_file_path, json_file_path
+
+# Build the model of data/models/<model_name>.xmi as the transformer does.
+def loadModel(model_name, parser = 'stream'):
+    xml_tree = transformateur.loadXmi(f'data/models/{model_name}.xmi', parser)
+    transformateur.loadOperations(f'data/gama/{model_name}.json')
+    return (xml_tree,) + transformateur.buildModel(xml_tree)
+
+# Every rendered element of a model, with the name of its template.
+def collectElements(xml_tree, uml_classes, uml_global, uml_experiment):
+    elements = []
+    controllers = transformateur.getControllers(transformateur.extractPackageTag(xml_tree, {'name': 'meta_model'}))
+    for states in controllers.values():
+        elements.extend(('UmlState', state) for state in states.values())
+    elements.extend(('GamlInstance', instance) for instance in transformateur.instanciation(xml_tree, uml_classes).instances())
+    blocks = [block for block in [uml_global, uml_experiment] if block] + uml_classes
+    for block in blocks:
+        elements.append((type(block).__name__, block))
+        for attribute in block.attributes:
+            elements.append(('UmlAttribute', attribute))
+        for operation in block.operations:
+            elements.append(('UmlOperation', operation))
+    return elements
+
+def timeRenders(elements, render, repeat):
+    timings = {}
+    for _ in range(repeat):
+        for name, element in elements:
+            start = time.perf_counter()
+            render(name, element)
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+    return timings
+
+# Render time per element with a template compiled on every call (before) and with the shared registry (after).
+# Nested attributes and operations of the blocks are rendered through the registry in both cases.
+def benchTemplates(model_names, repeat):
+    results = {}
+    for model_name in model_names:
+        elements = collectElements(*loadModel(model_name))
+        counts = {}
+        for name, _ in elements:
+            counts[name] = counts.get(name, 0) + 1
+        templates = {name: getattr(transformateur, name).template for name in counts}
+        before = timeRenders(elements, lambda name, element: Template(templates[name], trim_blocks=True, lstrip_blocks=True).render(transformateur.getContext(element)), repeat)
+        after = timeRenders(elements, lambda name, element: transformateur.getTemplate(name).render(transformateur.getContext(element)), repeat)
+        results[model_name] = {}
+        print(f'{model_name} ({repeat} runs)')
+        print(f'    {"template":<16}{"elements":>10}{"before (us)":>14}{"after (us)":>14}{"speedup":>10}')
+        for name in counts:
+            per_before = before[name] / (counts[name] * repeat) * 1e6
+            per_after = after[name] / (counts[name] * repeat) * 1e6
+            results[model_name][name] = {'elements': counts[name], 'before_us': per_before, 'after_us': per_after}
+            print(f'    {name:<16}{counts[name]:>10}{per_before:>14.1f}{per_after:>14.1f}{per_before / per_after:>9.1f}x')
+    return results
+
+
+# Time of each phase of a transformation (best of repeat runs).
+def timePhases(xmi_file_path, json_file_path, parser = 'stream', repeat = 1):
+    best = {}
+    for _ in range(repeat):
+        timings = {}
+        transformateur.clearFragmentCaches() # Each run starts as a new model.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            start = time.perf_counter()
+            xml_tree = transformateur.loadXmi(xmi_file_path, parser)
+            timings['parse'] = time.perf_counter() - start
+            transformateur.loadOperations(json_file_path)
+            start = time.perf_counter()
+            uml_classes = transformateur.buildClassDiagram(xml_tree, 'meta_model')
+            timings['buildClassDiagram'] = time.perf_counter() - start
+            start = time.perf_counter()
+            transformateur.getControllers(transformateur.extractPackageTag(xml_tree, {'name': 'meta_model'}))
+            timings['getControllers'] = time.perf_counter() - start
+            start = time.perf_counter()
+            transformateur.instanciation(xml_tree, uml_classes)
+            timings['instanciation'] = time.perf_counter() - start
+            start = time.perf_counter()
+            uml_global = transformateur.getGlobal(xml_tree, uml_classes)
+            uml_experiment = transformateur.getExperiment(xml_tree)
+            timings['getGlobal/getExperiment'] = time.perf_counter() - start
+            start = time.perf_counter()
+            fragments = [''.join(block.generateGaml()) for block in [uml_global, uml_experiment] + uml_classes if block]
+            timings['render'] = time.perf_counter() - start
+            start = time.perf_counter()
+            with open(os.devnull, 'w', encoding='utf-8') as fout:
+                for fragment in fragments:
+                    fout.write(fragment + '\n')
+            timings['write'] = time.perf_counter() - start
+        for phase in timings:
+            best[phase] = min(best.get(phase, float('inf')), timings[phase])
+    best['total'] = sum(best.values())
+    return best
+
+def getEnvironment(parser):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit, 'version': transformateur.__version__, 'python': platform.python_version(), 'machine': platform.machine(), 'parser': parser, 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+# Run the phases on synthetic models over the cartesian product of the swept sizes.
+def benchSuite(sweep, parser, repeat, output_file_path = None, directory = None):
+    work_directory = directory if directory else tempfile.mkdtemp(prefix='umltogama_')
+    results = {'environment': getEnvironment(parser), 'runs': []}
+    keys = list(sweep)
+    try:
+        for values in itertools.product(*[sweep[key] for key in keys]):
+            config = dict(zip(keys, values))
+            xmi_file_path, json_file_path = generateSyntheticModel(work_directory, config)
+            run = {'config': config, 'xmi_bytes': os.path.getsize(xmi_file_path), 'phases': timePhases(xmi_file_path, json_file_path, parser, repeat)}
+            results['runs'].append(run)
+            print(' '.join(f'{key}={config[key]}' for key in keys) + f' ({run["xmi_bytes"] / 1e6:.1f} MB)')
+            print('    ' + '  '.join(f'{phase} {duration * 1000:.1f}ms' for phase, duration in run['phases'].items()))
+    finally:
+        if not directory:
+            shutil.rmtree(work_directory)
+    if output_file_path:
+        with open(output_file_path, 'w', encoding='utf-8') as fout:
+            json.dump(results, fout, indent=4)
+    return results
+
+# Memory traced while a synthetic model is parsed and built, and memory still held by the model once the parsed tree is released.
+def benchMemory(config, parser, directory = None):
+    work_directory = directory if directory else tempfile.mkdtemp(prefix='umltogama_')
+    try:
+        xmi_file_path, json_file_path = generateSyntheticModel(work_directory, config)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            transformateur.loadOperations(json_file_path)
+            for name in transformateur.getTemplateEnvironment().loader.mapping: # Compiled templates are not part of the model.
+                transformateur.getTemplate(name)
+            gc.collect()
+            tracemalloc.start()
+            xml_tree = transformateur.loadXmi(xmi_file_path, parser)
+            tree_size = tracemalloc.get_traced_memory()[0]
+            model = transformateur.buildModel(xml_tree)
+            del xml_tree
+            transformateur.releaseXmi()
+            gc.collect()
+            model_size, peak_size = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        pickled_size = len(pickle.dumps(model))
+    finally:
+        if not directory:
+            shutil.rmtree(work_directory)
+    print(' '.join(f'{key}={config[key]}' for key in config) + f' ({parser})')
+    print(f'    parsed tree {tree_size / 2**20:.1f} MiB  model {model_size / 2**20:.1f} MiB  peak {peak_size / 2**20:.1f} MiB  pickled model {pickled_size / 2**20:.1f} MiB')
+    return {'tree': tree_size, 'model': model_size, 'peak': peak_size, 'pickled': pickled_size}
+
+# Modules imported by each mode of the transformer (python -X importtime) and modules which these modes must not import.
+# Modes run in this order, in a copy of data/ so that the json mode can write its file: the transform mode fills the model cache read by the cached mode.
+import_modes = {
+    'transform': (['-f', '{model}', '-o', '{output}'], ['bs4', 'concurrent.futures', 'cProfile', 'csv']),
+    'cached'   : (['-f', '{model}', '-o', '{output}'], ['lxml.etree', 'bs4', 'concurrent.futures', 'cProfile', 'csv']),
+    'bs4'      : (['-f', '{model}', '-o', '{output}', '-p', 'bs4', '--no-cache'], ['concurrent.futures', 'cProfile']),
+    'json'     : (['-j', '{model}'], ['jinja2', 'bs4', 'concurrent.futures', 'cProfile', 'csv'])
+}
+
+def parseImportTimes(stderr):
+    modules = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('| imported package'):
+            self_time, _, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = int(self_time) / 1e6
+    return modules
+
+def benchImports(model_name):
+    work_directory = tempfile.mkdtemp(prefix='umltogama_')
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transformateur.py')
+    failures = 0
+    try:
+        for directory in ['models', 'gama']:
+            shutil.copytree(os.path.join(os.path.dirname(script_path), 'data', directory), os.path.join(work_directory, 'data', directory))
+        for mode, (arguments, forbidden_modules) in import_modes.items():
+            arguments = [argument.format(model=model_name, output=os.path.join(work_directory, 'output.gaml')) for argument in arguments]
+            process = subprocess.run([sys.executable, '-X', 'importtime', script_path] + arguments + ['--cache-dir', os.path.join(work_directory, 'cache')], capture_output=True, text=True, cwd=work_directory)
+            if process.returncode:
+                print(f'{mode:<10} failed\n{process.stderr}')
+                failures += 1
+                continue
+            modules = parseImportTimes(process.stderr)
+            imported = sorted(module for module in forbidden_modules if any(name == module or name.startswith(f'{module}.') for name in modules))
+            print(f'{mode:<10} {sum(modules.values()) * 1000:7.1f}ms  {len(modules):4d} modules' + (f'  unexpected imports: {", ".join(imported)}' if imported else ''))
+            failures += bool(imported)
+    finally:
+        shutil.rmtree(work_directory)
+    return failures
+
+# Throughput (models/s) of the batch mode, process pool alone or asynchronous pipeline, on copies of the bundled models.
+# Latency (seconds) is slept before each read of a file to emulate a slow storage (network share, object store): in the pool worker, or around readBytes for the pipeline.
+def readSlowly(model, latency, parser, compact_instances):
+    time.sleep(2 * latency) # XMI and json files.
+    return transformateur.transformBatchModel(*model, parser, compact_instances, False, None)
+
+def transformPool(models, workers, parser, compact_instances, latency):
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(readSlowly, models, *[[value] * len(models) for value in [latency, parser, compact_instances]]))
+
+def transformPipelineSlowly(models, workers, parser, queue_size, latency):
+    read_bytes = transformateur.readBytes
+
+    def readBytesSlowly(file_path):
+        time.sleep(latency)
+        return read_bytes(file_path)
+
+    transformateur.readBytes = readBytesSlowly if latency else read_bytes
+    try:
+        return transformateur.transformPipeline(models, workers, parser, False, None, 0, queue_size)
+    finally:
+        transformateur.readBytes = read_bytes
+
+def benchPipeline(model_names, copies, workers, latencies, queue_size, parser):
+    work_directory = tempfile.mkdtemp(prefix='umltogama_')
+    try:
+        for directory in ['models', 'gama', 'outputs']:
+            os.makedirs(os.path.join(work_directory, directory))
+        for model_name in model_names:
+            for i_copy in range(copies):
+                for directory, extension in [('models', 'xmi'), ('gama', 'json')]:
+                    shutil.copyfile(os.path.join('data', directory, f'{model_name}.{extension}'), os.path.join(work_directory, directory, f'{model_name}{i_copy}.{extension}'))
+        models = transformateur.findModels(os.path.join(work_directory, 'models'), os.path.join(work_directory, 'outputs'))
+        print(f'{len(models)} models, {workers} workers, queue size {queue_size}')
+        for latency in latencies:
+            durations = {}
+            for mode in ['pool', 'pipeline']:
+                start_time = time.time()
+                if mode == 'pool':
+                    results = transformPool(models, workers, parser, False, latency)
+                else:
+                    results = transformPipelineSlowly(models, workers, parser, queue_size, latency)
+                durations[mode] = time.time() - start_time
+                failures = [result for result in results if result[2]]
+                if failures:
+                    print(f'    {mode}: {len(failures)} failed ({failures[0][2]})')
+            print(f'latency {latency * 1000:6.1f}ms  ' + '  '.join(f'{mode} {len(models) / duration:6.1f} models/s' for mode, duration in durations.items()) + f'  speedup {durations["pool"] / durations["pipeline"]:.2f}')
+    finally:
+        shutil.rmtree(work_directory)
+
+# Throughput of one Transformer session serving concurrent requests from a thread pool (outputs checked against a sequential run).
+# The first transformation of a session compiles the templates, the next ones reuse them.
+def benchSessions(model_names, threads, requests, parser):
+    from concurrent.futures import ThreadPoolExecutor
+    inputs = []
+    for model_name in model_names:
+        with open(os.path.join('data', 'models', f'{model_name}.xmi'), 'rb') as fin, open(os.path.join('data', 'gama', f'{model_name}.json'), 'rb') as json_fin:
+            inputs.append((fin.read(), json_fin.read(), model_name))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        session = transformateur.Transformer(parser=parser)
+        start_time = time.perf_counter()
+        expected = [session.transform(*model_input) for model_input in inputs]
+        cold = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for model_input in inputs:
+            session.transform(*model_input)
+        print(f'{len(inputs)} models, first run {cold * 1000:.1f}ms, warm run {(time.perf_counter() - start_time) * 1000:.1f}ms')
+        for n_threads in threads:
+            session = transformateur.Transformer(parser=parser)
+            for model_input in inputs: # Warm session.
+                session.transform(*model_input)
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                outputs = list(executor.map(lambda i_request: session.transform(*inputs[i_request % len(inputs)]), range(requests)))
+            duration = time.perf_counter() - start_time
+            mismatches = sum(output != expected[i_request % len(inputs)] for i_request, output in enumerate(outputs))
+            print(f'{n_threads:>3} threads  {requests / duration:8.1f} transforms/s  {duration / requests * 1000:7.2f}ms per request' + (f'  {mismatches} MISMATCHES' if mismatches else ''))
+
+# Parse time and peak resident memory of each parser on a synthetic XMI of about size MB, each parser in its own process.
+# The bs4-text mode is bs4 reading the file decoded as utf-8 text, as before the bytes were passed to it.
+parse_probe = '''
+import sys, time, json, resource, warnings
+warnings.simplefilter('ignore')
+sys.path.insert(0, sys.argv[1])
+import transformateur
+mode, xmi_file_path = sys.argv[2:4]
+start = time.perf_counter()
+if mode == 'bs4-text':
+    transformateur.parseXmi(xmi_file_path, 'bs4')
+else:
+    transformateur.loadXmi(xmi_file_path, mode)
+print(json.dumps({'seconds': time.perf_counter() - start, 'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}))
+'''
+
+def generateSizedModel(directory, size):
+    sizes = []
+    for instances in [0, 1000]: # XMI bytes per instance.
+        xmi_file_path, _ = generateSyntheticModel(directory, dict(synthetic_defaults, instances=instances))
+        sizes.append(os.path.getsize(xmi_file_path))
+    instances = max(0, int((size * 1e6 - sizes[0]) * 1000 / (sizes[1] - sizes[0])))
+    return generateSyntheticModel(directory, dict(synthetic_defaults, instances=instances))[0]
+
+def benchParse(size, parsers, directory = None):
+    work_directory = directory if directory else tempfile.mkdtemp(prefix='umltogama_')
+    try:
+        xmi_file_path = generateSizedModel(work_directory, size)
+        print(f'{os.path.getsize(xmi_file_path) / 1e6:.1f} MB XMI')
+        for mode in parsers:
+            process = subprocess.run([sys.executable, '-c', parse_probe, os.path.dirname(os.path.abspath(__file__)), mode, xmi_file_path], capture_output=True, text=True)
+            if process.returncode:
+                print(f'{mode:<8} failed\n{process.stderr}')
+                continue
+            result = json.loads(process.stdout)
+            print(f'{mode:<8} parse {result["seconds"]:8.2f}s  peak RSS {result["peak_rss"] / 2**20:8.1f} MiB')
+    finally:
+        if not directory:
+            shutil.rmtree(work_directory)
+
+# Byte parity of the generated gaml between the parsers, bs4 being the reference: each bundled model is transformed by the command line with every parser.
+# The models are also transformed with the XMI, UML and XSI namespaces declared under other prefixes (not supported by bs4), against the same reference.
+def renamePrefixes(xmi):
+    for prefix, renamed_prefix in [('xmi', 'x'), ('uml', 'u'), ('xsi', 's')]:
+        xmi = re.sub(r'(?<![\w.])%s:' % prefix, f'{renamed_prefix}:', xmi).replace(f'xmlns:{prefix}=', f'xmlns:{renamed_prefix}=')
+    return xmi
+
+def runParser(script_path, directory, model_name, parser, compact_instances):
+    output_file_path = os.path.join(directory, f'{model_name}.{parser}.gaml')
+    process = subprocess.run([sys.executable, script_path, '-f', model_name, '-o', output_file_path, '-p', parser, '--no-cache'] + (['-c'] if compact_instances else []), capture_output=True, text=True, cwd=directory)
+    if process.returncode:
+        return None, process.stderr
+    with open(output_file_path, 'rb') as fin:
+        return fin.read(), None
+
+def checkParity(parsers, compact_instances = False):
+    work_directory = tempfile.mkdtemp(prefix='umltogama_')
+    renamed_directory = os.path.join(work_directory, 'renamed')
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transformateur.py')
+    failures = 0
+    try:
+        for directory in ['models', 'gama']:
+            shutil.copytree(os.path.join(os.path.dirname(script_path), 'data', directory), os.path.join(work_directory, 'data', directory))
+            shutil.copytree(os.path.join(os.path.dirname(script_path), 'data', directory), os.path.join(renamed_directory, 'data', directory))
+        model_names = sorted(os.path.splitext(file_name)[0] for file_name in os.listdir(os.path.join(work_directory, 'data', 'models')) if file_name.endswith('.xmi'))
+        for model_name in model_names:
+            xmi_file_path = os.path.join(renamed_directory, 'data', 'models', f'{model_name}.xmi')
+            with open(xmi_file_path, encoding='utf-8') as fin:
+                xmi = renamePrefixes(fin.read())
+            with open(xmi_file_path, 'w', encoding='utf-8') as fout:
+                fout.write(xmi)
+            reference, error = runParser(script_path, work_directory, model_name, 'bs4', compact_instances)
+            if reference is None:
+                print(f'{model_name:<16} bs4 failed\n{error}')
+                failures += 1
+                continue
+            for directory, parser, label in [(work_directory, parser, parser) for parser in parsers] + [(renamed_directory, parser, f'{parser} (renamed prefixes)') for parser in parsers]:
+                output, error = runParser(script_path, directory, model_name, parser, compact_instances)
+                if output is None:
+                    print(f'{model_name:<16} {label:<26} failed\n{error}')
+                    failures += 1
+                    continue
+                identical = output == reference
+                print(f'{model_name:<16} {label:<26} ' + ('identical' if identical else 'DIFFERENT') + ' to bs4')
+                failures += not identical
+    finally:
+        shutil.rmtree(work_directory)
+    return failures
+
+# Compare the phases of two result files run by run (same configurations).
+def compareResults(old_file_path, new_file_path):
+    with open(old_file_path, encoding='utf-8') as fin:
+        old_results = json.load(fin)
+    with open(new_file_path, encoding='utf-8') as fin:
+        new_results = json.load(fin)
+    old_runs = {json.dumps(run['config'], sort_keys=True): run for run in old_results['runs']}
+    print(f'{old_results["environment"]["commit"]} -> {new_results["environment"]["commit"]} (ratio new/old, > 1 is slower)')
+    for run in new_results['runs']:
+        key = json.dumps(run['config'], sort_keys=True)
+        if key in old_runs:
+            old_phases = old_runs[key]['phases']
+            print(' '.join(f'{name}={value}' for name, value in run['config'].items()))
+            print('    ' + '  '.join(f'{phase} {run["phases"][phase] / old_phases[phase]:.2f}' for phase in run['phases'] if old_phases.get(phase)))
+
+
+if __name__== "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the UML to GAMA transformer.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    templates_parser = subparsers.add_parser('templates', help='Render time per element before and after the shared template registry.')
+    templates_parser.add_argument('-m', '--models', nargs='+', default=['preyPredator', 'lunerayFlu'], help='Names of the models on data/models and data/gama.')
+    templates_parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of renders per element.')
+    suite_parser = subparsers.add_parser('suite', help='Time the phases of the transformation on synthetic models over size sweeps.')
+    for key, value in synthetic_defaults.items():
+        suite_parser.add_argument(f'--{key.replace("_", "-")}', type=int, nargs='+', default=[value], help=f'Swept values (default: {value}).')
+    suite_parser.add_argument('-p', '--parser', type=str, default='stream', choices=['stream', 'bs4', 'lxml'], help='XMI parser backend.')
+    suite_parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per configuration, the best one is kept.')
+    suite_parser.add_argument('-o', '--output', type=str, help='Json file where the results are saved.')
+    suite_parser.add_argument('-d', '--directory', type=str, help='Directory where the synthetic models are kept (default: temporary).')
+    fsm_parser = subparsers.add_parser('fsm', help='Time the phases on state machine heavy synthetic models (hundreds of states, thousands of transitions).')
+    fsm_parser.add_argument('-p', '--parser', type=str, default='stream', choices=['stream', 'bs4', 'lxml'], help='XMI parser backend.')
+    fsm_parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per configuration, the best one is kept.')
+    fsm_parser.add_argument('-o', '--output', type=str, help='Json file where the results are saved.')
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files of the suite benchmark.')
+    compare_parser.add_argument('old', type=str)
+    compare_parser.add_argument('new', type=str)
+    imports_parser = subparsers.add_parser('imports', help='Import time of each mode of the transformer, failing when a mode imports a module it does not need.')
+    imports_parser.add_argument('-m', '--model', type=str, default='preyPredator', help='Name of the model on data/models and data/gama.')
+    memory_parser = subparsers.add_parser('memory', help='Memory of the parsed tree and of the built model of a synthetic model (tracemalloc).')
+    for key, value in synthetic_defaults.items():
+        memory_parser.add_argument(f'--{key.replace("_", "-")}', type=int, default=value, help=f'(default: {value}).')
+    memory_parser.add_argument('-p', '--parser', type=str, default='stream', choices=['stream', 'bs4', 'lxml'], help='XMI parser backend.')
+    memory_parser.add_argument('-d', '--directory', type=str, help='Directory where the synthetic model is kept (default: temporary).')
+    pipeline_parser = subparsers.add_parser('pipeline', help='Throughput of the batch mode, process pool against asynchronous pipeline, with a latency injected on each read.')
+    pipeline_parser.add_argument('-m', '--models', nargs='+', default=['preyPredator', 'lunerayFlu'], help='Names of the models on data/models and data/gama.')
+    pipeline_parser.add_argument('-n', '--copies', type=transformateur.positiveInt, default=10, help='Copies of each model in the batch.')
+    pipeline_parser.add_argument('-w', '--workers', type=transformateur.positiveInt, default=os.cpu_count() or 1, help='Worker processes.')
+    pipeline_parser.add_argument('-l', '--latencies', type=float, nargs='+', default=[0.0, 0.02, 0.1], help='Latencies (seconds) injected on each read.')
+    pipeline_parser.add_argument('-q', '--queue-size', type=transformateur.positiveInt, default=4, help='Models waiting between two stages of the pipeline.')
+    pipeline_parser.add_argument('-p', '--parser', type=str, default='stream', choices=['stream', 'bs4', 'lxml'], help='XMI parser backend.')
+    sessions_parser = subparsers.add_parser('sessions', help='Throughput of a warm Transformer session serving concurrent requests from N threads.')
+    sessions_parser.add_argument('-m', '--models', nargs='+', default=['preyPredator', 'lunerayFlu'], help='Names of the models on data/models and data/gama.')
+    sessions_parser.add_argument('-t', '--threads', type=transformateur.positiveInt, nargs='+', default=[1, 2, 4, 8], help='Numbers of threads.')
+    sessions_parser.add_argument('-n', '--requests', type=transformateur.positiveInt, default=200, help='Transformations per number of threads.')
+    sessions_parser.add_argument('-p', '--parser', type=str, default='stream', choices=['stream', 'bs4', 'lxml'], help='XMI parser backend.')
+    parse_parser = subparsers.add_parser('parse', help='Parse time and peak RSS of the parsers on a large synthetic XMI file.')
+    parse_parser.add_argument('-s', '--size', type=float, default=500, help='Approximate size of the XMI file in MB.')
+    parse_parser.add_argument('-p', '--parsers', nargs='+', default=['stream', 'lxml'], choices=['stream', 'lxml', 'bs4', 'bs4-text'], help='Parsers to run (bs4-text: bs4 on the decoded text, decoded as utf-8 text).')
+    parse_parser.add_argument('-d', '--directory', type=str, help='Directory where the synthetic model is kept (default: temporary).')
+    parity_parser = subparsers.add_parser('parity', help='Byte parity of the gaml generated from data/models by each parser against bs4, failing on any difference.')
+    parity_parser.add_argument('-p', '--parsers', nargs='+', default=['stream', 'lxml'], choices=['stream', 'lxml'], help='Parsers compared to bs4 (on the bundled models and on copies declaring the namespaces under other prefixes).')
+    parity_parser.add_argument('-c', '--compact-instances', action='store_true', help='Compare the outputs with compacted instances.')
+    generate_parser = subparsers.add_parser('generate', help='Write a synthetic XMI file and its json file.')
+    for key, value in synthetic_defaults.items():
+        generate_parser.add_argument(f'--{key.replace("_", "-")}', type=int, default=value, help=f'(default: {value}).')
+    generate_parser.add_argument('-n', '--name', type=str, default='synthetic', help='Model name.')
+    generate_parser.add_argument('-d', '--directory', type=str, default='.', help='Output directory.')
+    args = parser.parse_args()
+
+    if args.benchmark == 'templates':
+        benchTemplates(args.models, args.repeat)
+    elif args.benchmark == 'suite':
+        benchSuite({key: getattr(args, key) for key in synthetic_defaults}, args.parser, args.repeat, args.output, args.directory)
+    elif args.benchmark == 'fsm':
+        benchSuite(fsm_sweep, args.parser, args.repeat, args.output)
+    elif args.benchmark == 'compare':
+        compareResults(args.old, args.new)
+    elif args.benchmark == 'imports':
+        sys.exit(1 if benchImports(args.model) else 0)
+    elif args.benchmark == 'memory':
+        benchMemory({key: getattr(args, key) for key in synthetic_defaults}, args.parser, args.directory)
+    elif args.benchmark == 'pipeline':
+        benchPipeline(args.models, args.copies, args.workers, args.latencies, args.queue_size, args.parser)
+    elif args.benchmark == 'sessions':
+        benchSessions(args.models, args.threads, args.requests, args.parser)
+    elif args.benchmark == 'parse':
+        benchParse(args.size, args.parsers, args.directory)
+    elif args.benchmark == 'parity':
+        sys.exit(1 if checkParity(args.parsers, args.compact_instances) else 0)
+    elif args.benchmark == 'generate':
+        print(generateSyntheticModel(args.directory, {key: getattr(args, key) for key in synthetic_defaults}, args.name))
+    else:
+        parser.print_help()
@@ -1,9 +1,18 @@
 # -*- encoding: utf-8 -*-
 
-import re, codecs, json, bs4, warnings, argparse, time
+import re, codecs, json, warnings, argparse, time, os, sys, io, hashlib, threading, copy, pickle, atexit
 from os import path
-from jinja2 import Template
-from functools import reduce
+from functools import reduce, wraps
+from itertools import groupby
+from bisect import bisect_left
+from array import array
+# jinja2, lxml, bs4, csv, glob, cProfile, concurrent.futures and difflib are imported by the modes using them (python benchmark.py imports checks it).
+
+__version__ = '1.2.1'
+
+# Hash of this script, computed once: the cached models and fragments are invalidated by any change of the transformation logic, not only by a new version.
+with open(__file__, 'rb') as fin:
+    source_digest = hashlib.sha1(fin.read()).hexdigest()
 
 # Error and warning codes.
 error_codes = {
@@ -33,21 +42,540 @@ warning_codes = {
 }
 
 def raiseWarning(code, *args):
+    profiler.count('warnings')
     warnings.warn(warning_codes[code](*args))
 
+# Instrumentation: phase timers and counters, doing nothing unless the profiler is enabled.
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.stack = [] # Names of the running phases.
+        self.events = [] # (phase path, start, duration, thread id).
+        self.counters = {}
+
+    def phase(self, name):
+        return ProfilerPhase(self, name) if self.enabled else disabled_phase
+
+    def count(self, name, value = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        phases = {}
+        for phase_path, _, duration, _ in self.events:
+            calls, total = phases.get(phase_path, (0, 0.0))
+            phases[phase_path] = (calls + 1, total + duration)
+        lines = ['Phases:']
+        for phase_path in sorted(phases, key=lambda phase_path: min(event[1] for event in self.events if event[0][:len(phase_path)] == phase_path)):
+            calls, total = phases[phase_path]
+            label = '  ' * len(phase_path) + phase_path[-1] + (f' (x{calls})' if calls > 1 else '')
+            lines.append(f'{label:<44}{total * 1000:>10.2f} ms')
+        lines.append('Counters:')
+        for name in sorted(self.counters):
+            lines.append(f'  {name:<42}{self.counters[name]:>10}')
+        return '\n'.join(lines)
+
+    # Chrome trace event format (chrome://tracing, Perfetto).
+    def writeTrace(self, file_path):
+        trace_events = [{'name': phase_path[-1], 'cat': '/'.join(phase_path), 'ph': 'X', 'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6, 'pid': os.getpid(), 'tid': thread_id} for phase_path, start, duration, thread_id in self.events]
+        trace_events.append({'name': 'counters', 'ph': 'C', 'ts': (time.perf_counter() - self.origin) * 1e6, 'pid': os.getpid(), 'args': self.counters})
+        with codecs.open(file_path, 'w', encoding='utf-8') as fout:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, fout)
+
+class ProfilerPhase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack.append(self.name)
+        self.path = tuple(self.profiler.stack)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.profiler.events.append((self.path, self.start, time.perf_counter() - self.start, threading.get_ident()))
+        self.profiler.stack.pop()
+        return False
+
+class DisabledPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+disabled_phase = DisabledPhase()
+profiler = Profiler()
+
+# Time every call of the decorated function as a phase.
+def profiled(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with ProfilerPhase(profiler, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Transformation state.
+# What belongs to the transformed document (XMI index, property and XPath caches, memoized fragments) and the operation bodies are bound to the current thread,
+# so the transformations of a Transformer session can run concurrently in several threads.
+class TransformationState(threading.local):
+    def __init__(self):
+        self.transformer = None # Session of the running transformation, the default session otherwise.
+        self.operations = {} # Class name -> operation name -> gaml body.
+        self.xmi_index = None
+        self.property_cache = {}
+        self.xpath_namespaces = {'xsi': 'http://www.w3.org/2001/XMLSchema-instance'} # Prefixes of the parsed document (canonical ones for the XMI, XSI and UML namespaces).
+        self.type_prefixes = {} # Prefix of the document -> canonical prefix, when the document declares a known namespace under another prefix (xsi:type values).
+        self.xpath_queries = {}
+        self.xpath_document_results = {} # (tag name, xsi:type) -> tags of the whole document.
+        self.heading_cache = {} # (excluded properties, property items) -> heading.
+        self.fragment_cache = {} # (template name, template fields) -> rendered fragment.
+
+thread_state = TransformationState()
+
+def getTransformer():
+    return thread_state.transformer if thread_state.transformer is not None else default_transformer
+
+# Templates (compiled once per session, optionally cached on disk as bytecode).
+def getTemplateSources():
+    return {templated_class.__name__: templated_class.template for templated_class in (UmlState, UmlClass, UmlAttribute, UmlOperation, GamlGlobal, GamlInstance, GamlExperiment)}
+
+def configureTemplates(cache_directory = None):
+    return getTransformer().configureTemplates(cache_directory)
+
+def getTemplateEnvironment():
+    return getTransformer().getTemplateEnvironment()
+
+# Context of a template: the slots of the rendered model object.
+def getContext(model_object):
+    return {name: getattr(model_object, name) for name in model_object.__slots__}
+
+def getTemplate(name):
+    profiler.count('template renders')
+    return getTransformer().getTemplate(name)
+
+# Memoized fragments: identical headings and identical attribute/operation declarations are built once and the same string is shared (within a transformation).
+def getPropertyHeading(properties, excluded):
+    heading_cache = thread_state.heading_cache
+    key = (excluded, tuple(properties.items()))
+    heading = heading_cache.get(key)
+    if heading is None:
+        heading = heading_cache[key] = ' '.join(['%s: %s' % (property, properties[property]) for property in properties if property not in excluded])
+    return heading
+
+def renderInterned(name, model_object):
+    fragment_cache = thread_state.fragment_cache
+    key = (name,) + tuple(getattr(model_object, field) for field in model_object.template_fields)
+    try:
+        fragment = fragment_cache.get(key)
+    except TypeError: # Unhashable field (list default value).
+        return getTemplate(name).render(getContext(model_object)).strip()
+    if fragment is None:
+        fragment = fragment_cache[key] = getTemplate(name).render(getContext(model_object)).strip()
+    else:
+        profiler.count('fragment reuses')
+    return fragment
+
+def clearFragmentCaches():
+    thread_state.heading_cache.clear()
+    thread_state.fragment_cache.clear()
+
 # Attributes.
 def getAttributeValue(root, attribute_name):
     if not root.has_attr(attribute_name):
         raiseWarning('warn1', root['name'], attribute_name)
     return root[attribute_name] if root.has_attr(attribute_name) else None
 
-# Tags.
+# Namespaces.
+# The XMI, XSI and UML namespaces are known by their URI: tools may declare them under other prefixes, names and xsi:type values are read with the canonical ones.
+namespace_patterns = [
+    ('xmi', re.compile(r'https?://(schema|www)\.omg\.org/spec/XMI/')),
+    ('xsi', re.compile(r'http://www\.w3\.org/2001/XMLSchema-instance$')),
+    ('uml', re.compile(r'https?://((schema|www)\.omg\.org/spec/UML/|www\.eclipse\.org/uml2/.*/UML$)'))
+]
+
+def getCanonicalPrefix(uri, prefix = None):
+    for canonical_prefix, pattern in namespace_patterns:
+        if pattern.match(uri):
+            return canonical_prefix
+    return prefix
+
+def getTypePrefixes(namespaces): # Prefixes of a document (prefix -> URI) declaring a known namespace under another prefix -> canonical prefix.
+    return {prefix: getCanonicalPrefix(uri) for prefix, uri in namespaces.items() if prefix and getCanonicalPrefix(uri, prefix) != prefix}
+
+def canonicalType(value, type_prefixes): # x:Class -> uml:Class
+    if type_prefixes and value and ':' in value:
+        prefix, local_name = value.split(':', 1)
+        if prefix in type_prefixes:
+            return f'{type_prefixes[prefix]}:{local_name}'
+    return value
+
+def documentType(value, type_prefixes): # uml:Class -> x:Class
+    if type_prefixes and value and ':' in value:
+        prefix, local_name = value.split(':', 1)
+        for document_prefix in type_prefixes:
+            if type_prefixes[document_prefix] == prefix:
+                return f'{document_prefix}:{local_name}'
+    return value
+
+# Streaming backend.
+# Compact stand-in for a bs4 tag: only the name, the attributes and the child elements are kept, the xmi:Extension subtree is collapsed into properties.
+class XmiNode:
+    __slots__ = ('name', 'attrs', 'parent', 'children', 'properties')
+
+    def __init__(self, name, attrs, parent=None):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.children = []
+        self.properties = None
+
+    def has_attr(self, key):
+        return key in self.attrs
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+    def __repr__(self):
+        return f'<{self.name} {self.attrs}>'
+
+    def descendants(self):
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def match(self, tag_name, attributes):
+        if self.name != tag_name:
+            return False
+        for key in attributes:
+            if self.attrs.get(key) != attributes[key]:
+                return False
+        return True
+
+    def find(self, tag_name, attrs = {}):
+        for node in self.descendants():
+            if node.match(tag_name, attrs):
+                return node
+        return None
+
+    def find_all(self, tag_name, attrs = {}, recursive = True):
+        return [node for node in (self.descendants() if recursive else self.children) if node.match(tag_name, attrs)]
+
+# Build an XmiNode tree and its index from a XMI file with a single lxml iterparse pass.
+def parseXmiStream(source):
+    from lxml import etree
+    prefixes = {} # URI -> canonical prefix.
+    type_prefixes = {}
+
+    def qualify(name):
+        if name[0] == '{':
+            uri, local_name = name[1:].split('}', 1)
+            prefix = prefixes.get(uri)
+            return f'{prefix}:{local_name}' if prefix else local_name
+        return name
+
+    document = XmiNode('[document]', {})
+    stack = [document]
+    index = XmiIndex()
+    firsts = [index.open(document.name, document)] # Position of the first descendant of the nodes of the stack.
+    extension_depth = 0 # Depth inside the current xmi:Extension subtree.
+    extension_owner = None # Node receiving the details of the current xmi:Extension.
+    for event, item in etree.iterparse(source, events=('start-ns', 'start', 'end'), remove_comments=True, huge_tree=True):
+        if event == 'start-ns':
+            prefixes[item[1]] = getCanonicalPrefix(item[1], item[0])
+            type_prefixes.update(getTypePrefixes({item[0]: item[1]}))
+        elif event == 'start':
+            if extension_depth:
+                extension_depth += 1
+                if extension_owner is not None and qualify(item.tag) == 'details':
+                    extension_owner.properties[item.get('key')] = item.get('value')
+                continue
+            name = qualify(item.tag)
+            if name == 'xmi:Extension':
+                extension_depth = 1
+                extension_owner = stack[-1] if stack[-1].properties is None else None # Only the first extension is considered.
+                if extension_owner is not None:
+                    extension_owner.properties = {}
+                continue
+            node = XmiNode(name, {qualify(key): value for key, value in item.attrib.items()}, stack[-1])
+            if type_prefixes and 'xsi:type' in node.attrs:
+                node.attrs['xsi:type'] = canonicalType(node.attrs['xsi:type'], type_prefixes)
+            stack[-1].children.append(node)
+            stack.append(node)
+            firsts.append(index.open(name, node))
+        else:
+            if extension_depth:
+                extension_depth -= 1
+            else:
+                index.close(stack.pop(), firsts.pop())
+            item.clear() # Release the processed element and its already handled siblings.
+            while item.getprevious() is not None:
+                del item.getparent()[0]
+    index.close(document, firsts.pop())
+    indexXmi(document, index)
+    return document
+
+# XPath backend.
+# The tree is parsed by lxml into elements exposing the bs4 tag interface used by the transformer, tags are looked up with XPath queries compiled once per lookup.
+# The namespaces, compiled queries and results of the parsed document are kept in the transformation state.
+lxml_element_class = None
+xpath_lookups = [ # Lookups of the transformer, compiled with the namespaces of each document.
+    ('packagedElement', ('xsi:type', 'name')), # Packages by name.
+    ('packagedElement', ('xsi:type',)), # Packages, classes, enumerations, dependencies, state machines and instances.
+    ('generalization', ()),
+    ('ownedAttribute', ()),
+    ('ownedOperation', ()),
+    ('ownedParameter', ()),
+    ('ownedParameter', ('direction',)),
+    ('type', ()),
+    ('lowerValue', ()),
+    ('upperValue', ()),
+    ('defaultValue', ()),
+    ('subvertex', ()),
+    ('transition', ()),
+    ('ownedRule', ()),
+    ('specification', ()),
+    ('slot', ()),
+    ('value', ())
+]
+
+def expandName(name): # xmi:id -> {http://schema.omg.org/spec/XMI/2.1}id
+    if ':' in name:
+        prefix, local_name = name.split(':', 1)
+        xpath_namespaces = thread_state.xpath_namespaces
+        if prefix in xpath_namespaces:
+            return '{%s}%s' % (xpath_namespaces[prefix], local_name)
+    return name
+
+def qualifyName(name): # {http://schema.omg.org/spec/XMI/2.1}id -> xmi:id
+    if name[0] == '{':
+        uri, local_name = name[1:].split('}', 1)
+        xpath_namespaces = thread_state.xpath_namespaces
+        for prefix in xpath_namespaces:
+            if xpath_namespaces[prefix] == uri:
+                return f'{prefix}:{local_name}'
+        return local_name
+    return name
+
+def getLxmlElementClass():
+    global lxml_element_class
+    if lxml_element_class is None:
+        from lxml import etree
+
+        class LxmlElement(etree.ElementBase):
+            def __bool__(self): # A tag is true even without children.
+                return True
+
+            @property
+            def name(self):
+                return qualifyName(self.tag)
+
+            @property
+            def parent(self):
+                return self.getparent()
+
+            @property
+            def attrs(self):
+                return {qualifyName(key): canonicalType(value, thread_state.type_prefixes) if key == expandName('xsi:type') else value for key, value in self.attrib.items()}
+
+            @property
+            def children(self):
+                return [child for child in self.iterchildren() if isinstance(child, LxmlElement)]
+
+            def has_attr(self, key):
+                return expandName(key) in self.attrib
+
+            def get(self, key, default=None):
+                value = self.attrib.get(expandName(key), default)
+                return canonicalType(value, thread_state.type_prefixes) if key == 'xsi:type' else value
+
+            def __getitem__(self, key):
+                if not isinstance(key, str):
+                    return etree.ElementBase.__getitem__(self, key)
+                value = self.attrib[expandName(key)]
+                return canonicalType(value, thread_state.type_prefixes) if key == 'xsi:type' else value
+
+        lxml_element_class = LxmlElement
+    return lxml_element_class
+
+def isLxmlElement(root):
+    return lxml_element_class is not None and isinstance(root, lxml_element_class)
+
+def getXPathQuery(tag_name, attribute_names):
+    key = (tag_name, attribute_names)
+    xpath_queries = thread_state.xpath_queries
+    if key not in xpath_queries:
+        from lxml import etree
+        conditions = ''.join(f'[@{attribute_name}=$v{i_attribute}]' for i_attribute, attribute_name in enumerate(attribute_names))
+        xpath_queries[key] = etree.XPath(f'.//{tag_name}{conditions}', namespaces=thread_state.xpath_namespaces)
+    return xpath_queries[key]
+
+def findXPath(root, tag_name, attributes):
+    if root.getparent() is None: # The document is traversed once per tag name and type, packages are then found by name among them.
+        key = (tag_name, attributes.get('xsi:type'))
+        xpath_document_results = thread_state.xpath_document_results
+        if key not in xpath_document_results:
+            xpath_document_results[key] = getXPathQuery(tag_name, ('xsi:type',))(root, v0=documentType(key[1], thread_state.type_prefixes)) if key[1] else getXPathQuery(tag_name, ())(root)
+        return [tag for tag in xpath_document_results[key] if all(tag.get(attribute_name) == attributes[attribute_name] for attribute_name in attributes)]
+    attribute_names = tuple(attributes)
+    return getXPathQuery(tag_name, attribute_names)(root, **{f'v{i_attribute}': documentType(attributes[attribute_name], thread_state.type_prefixes) if attribute_name == 'xsi:type' else attributes[attribute_name] for i_attribute, attribute_name in enumerate(attribute_names)})
+
+def xpathProperties(root): # Details of the first xmi:Extension child.
+    return {detail.get('key'): detail.get('value') for detail in getXPathQuery('details', ('first extension',))(root)}
+
+def parseXmiLxml(file_path):
+    from lxml import etree
+    parser = etree.XMLParser(remove_comments=True, huge_tree=True)
+    parser.set_element_class_lookup(etree.ElementDefaultClassLookup(element=getLxmlElementClass()))
+    root = etree.parse(file_path, parser).getroot()
+    thread_state.xpath_namespaces.update({getCanonicalPrefix(uri, prefix): uri for prefix, uri in root.nsmap.items() if prefix})
+    thread_state.type_prefixes = getTypePrefixes(root.nsmap)
+    thread_state.xpath_queries.clear()
+    thread_state.xpath_document_results.clear()
+    thread_state.xpath_queries[('details', ('first extension',))] = etree.XPath('./xmi:Extension[1]//details', namespaces=thread_state.xpath_namespaces)
+    for tag_name, attribute_names in xpath_lookups:
+        getXPathQuery(tag_name, attribute_names)
+    return root
+
+# Parse a XMI file with the selected backend.
+def parseXmi(file_path, parser = 'stream'):
+    if parser == 'bs4':
+        import bs4 # Only imported by this backend.
+        if isinstance(file_path, str):
+            with codecs.open(file_path, 'r', encoding='utf-8') as fin:
+                xml_tree = bs4.BeautifulSoup(fin, 'xml')
+        else: # File object.
+            xml_tree = bs4.BeautifulSoup(file_path, 'xml')
+        cacheProperties(xml_tree)
+        indexXmi(xml_tree)
+    elif parser == 'lxml':
+        releaseXmi()
+        xml_tree = parseXmiLxml(file_path)
+    else:
+        xml_tree = parseXmiStream(file_path)
+    return xml_tree
+
+# Index of a XMI tree, built with a single traversal.
+# Elements are numbered in document order and grouped by name and by (name, xsi:type): the descendants of an element with a given name are a contiguous slice, found by bisection.
+# The elements owned by a class, an operation or an instance (and the classes of a package) are also grouped by parent, so that those of nested elements are not picked up.
+# The streaming parser fills the index while it reads the file, other trees are traversed once.
+class XmiIndex:
+    child_names = {'packagedElement', 'generalization', 'ownedAttribute', 'ownedOperation', 'ownedParameter', 'slot'} # Looked up among the direct children.
+
+    def __init__(self, root = None):
+        self.spans = {} # id(element) -> (element, position of its first descendant, position after its last descendant).
+        self.positions = {} # Key -> positions of the elements.
+        self.elements = {} # Key -> elements, in document order.
+        self.children = {} # (id(parent), name) -> direct children, in document order.
+        self.position = 0
+        if root is not None:
+            stack = [root]
+            while stack:
+                tag = stack.pop()
+                if isinstance(tag, tuple): # All the descendants of the element are numbered.
+                    self.close(*tag)
+                    continue
+                name = getTagName(tag)
+                if name == 'xmi:Extension': # Properties are cached apart.
+                    continue
+                stack.append((tag, self.open(name, tag)))
+                stack.extend(reversed(getChildren(tag)))
+
+    # Number an element, return the position of its first descendant.
+    def open(self, name, tag):
+        position = self.position
+        self.add(name, position, tag)
+        xsi_type = tag.get('xsi:type')
+        if xsi_type:
+            self.add((name, xsi_type), position, tag)
+        if name in XmiIndex.child_names and tag.parent is not None:
+            self.children.setdefault((id(tag.parent), name), []).append(tag)
+        self.position = position + 1
+        return self.position
+
+    def close(self, tag, first):
+        self.spans[id(tag)] = (tag, first, self.position)
+
+    def add(self, key, position, tag):
+        positions = self.positions.get(key)
+        if positions is None:
+            positions = self.positions[key] = []
+            self.elements[key] = []
+        positions.append(position)
+        self.elements[key].append(tag)
+
+    def covers(self, root):
+        span = self.spans.get(id(root))
+        return span is not None and span[0] is root
+
+    def findAll(self, root, tag_name, attributes):
+        _, first, end = self.spans[id(root)]
+        key = (tag_name, attributes['xsi:type']) if 'xsi:type' in attributes else tag_name
+        if key not in self.positions:
+            return []
+        positions = self.positions[key]
+        tags = self.elements[key][bisect_left(positions, first):bisect_left(positions, end)]
+        if len(attributes) > ('xsi:type' in attributes):
+            tags = [tag for tag in tags if all(tag.get(attribute) == attributes[attribute] for attribute in attributes)]
+        return tags
+
+    def findChildren(self, root, tag_name, attributes):
+        tags = self.children.get((id(root), tag_name), [])
+        return [tag for tag in tags if all(tag.get(attribute) == attributes[attribute] for attribute in attributes)] if attributes else tags
+
+def indexXmi(root, index = None):
+    thread_state.xmi_index = index if index else XmiIndex(root)
+    return thread_state.xmi_index
+
+# Drop the references kept on the parsed tree: the built model holds only plain data, so the tree can be freed.
+def releaseXmi():
+    thread_state.xmi_index = None
+    thread_state.property_cache.clear()
+    thread_state.xpath_document_results.clear() # Holds elements of the lxml tree (and through them, the whole document).
+    thread_state.xpath_queries.clear()
+    thread_state.type_prefixes = {}
+
+def getTagName(tag):
+    return f'{tag.prefix}:{tag.name}' if getattr(tag, 'prefix', None) else tag.name
+
+# Tags (looked up in the index of the tree when it is available).
 def extractTag(root, tag_name, attributes = {}):
+    xmi_index = thread_state.xmi_index
+    if xmi_index and xmi_index.covers(root):
+        tags = xmi_index.findAll(root, tag_name, attributes)
+        return tags[0] if tags else None
+    if isLxmlElement(root):
+        tags = findXPath(root, tag_name, attributes)
+        return tags[0] if tags else None
     return root.find(tag_name, attrs = attributes)
 
 def extractTags(root, tag_name, attributes = {}):
+    xmi_index = thread_state.xmi_index
+    if xmi_index and xmi_index.covers(root):
+        return xmi_index.findAll(root, tag_name, attributes)
+    if isLxmlElement(root):
+        return findXPath(root, tag_name, attributes)
     return root.find_all(tag_name, attrs = attributes)
 
+def extractChildren(root, tag_name, attributes = {}):
+    xmi_index = thread_state.xmi_index
+    if xmi_index and xmi_index.covers(root) and tag_name in XmiIndex.child_names:
+        return xmi_index.findChildren(root, tag_name, attributes)
+    if isLxmlElement(root):
+        return [tag for tag in root.iterchildren(expandName(tag_name)) if all(tag.get(attribute_name) == attributes[attribute_name] for attribute_name in attributes)]
+    return root.find_all(tag_name, attrs = attributes, recursive = False)
+
 # Packages.
 def extractPackageTag(root, attributes = {}):
     attributes.update({'xsi:type': 'uml:Package'})
@@ -57,9 +585,47 @@ def extractPackageTags(root, attributes = {}):
     attributes.update({'xsi:type': 'uml:Package'})
     return extractTags(root, 'packagedElement', attributes)
 
-# Properties.
+# Properties (cached per element, only the xmi:Extension direct child of an element is considered).
+def getPropertyKey(root):
+    return root['xmi:id'] if root.has_attr('xmi:id') else id(root)
+
+def extensionProperties(extension_tag):
+    return {prop['key']: prop['value'] for prop in extractTags(extension_tag, 'details')} if extension_tag else {}
+
+# Fill the property cache for the whole document: one scan of the xmi:Extension tags and one of their details.
+def cacheProperties(root):
+    property_cache = thread_state.property_cache
+    property_cache.clear()
+    extension_properties = {}
+    for extension_tag in extractTags(root, 'xmi:Extension'):
+        key = getPropertyKey(extension_tag.parent)
+        if key not in property_cache: # Only the first extension is considered.
+            property_cache[key] = extension_properties[id(extension_tag)] = {}
+    for detail_tag in extractTags(root, 'details'):
+        extension_tag = detail_tag.parent
+        while extension_tag is not None and id(extension_tag) not in extension_properties:
+            extension_tag = extension_tag.parent
+        if extension_tag is not None:
+            extension_properties[id(extension_tag)][detail_tag['key']] = detail_tag['value']
+
 def extractProperties(root):
-    return {prop['key']: prop['value'] for prop in extractTags(extractTag(root, 'xmi:Extension'), 'details')}
+    if isinstance(root, XmiNode):
+        return root.properties if root.properties is not None else {}
+    if isLxmlElement(root): # Element proxies are not kept by lxml, they can't be cached by id.
+        return xpathProperties(root)
+    property_cache = thread_state.property_cache
+    key = getPropertyKey(root)
+    if key not in property_cache: # Elements without extension.
+        profiler.count('property cache misses')
+        property_cache[key] = extensionProperties(root.find('xmi:Extension', recursive=False))
+    else:
+        profiler.count('property cache hits')
+    return property_cache[key]
+
+# Properties kept by the model: a copy detached from the parsed tree, without the uuid of the element.
+def getModelProperties(root):
+    properties = extractProperties(root)
+    return {key: properties[key] for key in properties if key != 'uuid'}
 
 def hasProperty(root, property_name):
     return property_name in extractProperties(root)
@@ -68,41 +634,45 @@ def hasProperty(root, property_name):
 def dependancyLink(root):
     return {tag['client']: tag['supplier'] for tag in extractTags(root, 'packagedElement', {'xsi:type': 'uml:Dependency'})}
 
-# Classes.
+# Classes (of the package itself, not of its sub-packages).
 def extractClasses(root):
-    return {tag['xmi:id']: tag for tag in extractTags(root, 'packagedElement', {'xsi:type': 'uml:Class'})}
+    return {tag['xmi:id']: tag for tag in extractChildren(root, 'packagedElement', {'xsi:type': 'uml:Class'})}
 
 # Enumerations.
 def extractEnumerations(root):
-    return {tag['xmi:id']: tag for tag in extractTags(root, 'packagedElement', {'xsi:type': 'uml:Enumeration'})}
+    return {tag['xmi:id']: tag for tag in extractChildren(root, 'packagedElement', {'xsi:type': 'uml:Enumeration'})}
 
 # Inheritance class links.
 def getParentClassId(root):
-    parents = extractTags(root, 'generalization')
+    parents = extractChildren(root, 'generalization')
     if len(parents) == 1:
         return parents[0]['general']
     elif len(parents) > 0:
         raiseException('err2', root['name']) # Only one possible inheritance.
 
 # Class diagram.
-def buildClassDiagram(root, package_name):
+@profiled('buildClassDiagram')
+def buildClassDiagram(root, package_name, class_ids = None): # Only the classes of class_ids are built when given.
     meta_model_package = extractPackageTag(root, {'name': package_name})
     class_tags = extractClasses(meta_model_package)
     enumeration_tags = extractEnumerations(meta_model_package)
     controllers = getControllers(meta_model_package) # Extract FSM.
     dependancy_links = dependancyLink(meta_model_package) # Link between FSM and classes.
+    rendered_controllers = {} # Behavior package id -> rendered states, shared by the classes depending on it.
     uml_classes = []
     for tag_id in class_tags:
         tag = class_tags[tag_id]
+        if class_ids is not None and tag_id not in class_ids:
+            continue
         if not tag.has_attr('isAbstract'): # Don't transfrom abstract classes.
             uml_class = UmlClass(tag)
-            uml_class.properties = extractProperties(tag)
+            uml_class.properties = getModelProperties(tag)
             parent_id = getParentClassId(tag)
             if parent_id:
                 uml_class.parent = class_tags[parent_id]['name']
-            for attribute_tag in extractTags(tag, 'ownedAttribute'): # Attributes.
+            for attribute_tag in extractChildren(tag, 'ownedAttribute'): # Attributes.
                 attribute = UmlAttribute(attribute_tag)
-                attribute.properties = extractProperties(attribute_tag)
+                attribute.properties = getModelProperties(attribute_tag)
                 attribute.getHeading()
                 attribute.type = getTypeValue(attribute_tag, class_tags, enumeration_tags)
                 attribute.is_list = isList(attribute_tag)
@@ -110,11 +680,11 @@ def buildClassDiagram(root, package_name):
                 if attribute.default_value:
                     attribute.default_value = convertDefaultValue(attribute.default_value, attribute.type)
                 uml_class.attributes.append(attribute)
-            for operation_tag in extractTags(tag, 'ownedOperation'): # Methods.
+            for operation_tag in extractChildren(tag, 'ownedOperation'): # Methods.
                 operation = UmlOperation(operation_tag)
-                operation.properties = extractProperties(operation_tag)
+                operation.properties = getModelProperties(operation_tag)
                 operation.getHeading()
-                return_parameter = extractTags(operation_tag, 'ownedParameter', {'direction': 'return'})
+                return_parameter = extractChildren(operation_tag, 'ownedParameter', {'direction': 'return'})
                 if len(return_parameter) > 1:
                     raiseWarning('warn2', operation.name)
                 elif len(return_parameter) == 1:
@@ -123,7 +693,7 @@ def buildClassDiagram(root, package_name):
                     operation.is_list = isList(return_parameter[0])
                 elif operation_tag['name'] != 'init': # Init function doesn't have return.
                     operation.type = UmlOperation.gaml_operation_name
-                parameters = extractTags(operation_tag, 'ownedParameter') # Method parameters.
+                parameters = extractChildren(operation_tag, 'ownedParameter') # Method parameters.
                 operation_parameters = []
                 for i_param in range(0, len(parameters)):
                     if parameters[i_param].has_attr('name') and (not parameters[i_param].has_attr('direction') or (parameters[i_param].has_attr('direction') and parameters[i_param]['direction'] != 'return')):
@@ -134,14 +704,20 @@ def buildClassDiagram(root, package_name):
                 operation.getParameters(operation_parameters)
                 uml_class.operations.append(operation)
             if tag_id in dependancy_links:
-                for state_id in controllers[dependancy_links[tag_id]]:
-                    uml_class.controllers.append(controllers[dependancy_links[tag_id]][state_id].translateToGaml())
+                behavior_id = dependancy_links[tag_id]
+                if behavior_id not in rendered_controllers:
+                    rendered_controllers[behavior_id] = [state.translateToGaml() for state in controllers[behavior_id].values()]
+                else:
+                    profiler.count('state machine reuses')
+                uml_class.controllers.extend(rendered_controllers[behavior_id])
+                uml_class.states.extend(controllers[behavior_id].values())
             uml_class.getHeading()
             uml_class.getType()
             uml_classes.append(uml_class)
     return uml_classes
 
 # Extract behaviors from packages inside meta_model package.
+@profiled('getControllers')
 def getControllers(root):
     controller_tags = {tag['xmi:id']: tag for tag in extractPackageTags(root)} # All packages inside meta_model package have to be behaviors and have behavior as property.
     behaviors = {}
@@ -157,69 +733,166 @@ def getControllers(root):
                 vertex.actions = [key for key in extractProperties(vertex_tag) if key != 'uuid']
                 states[vertex.state_id] = vertex
             transitions = extractTags(state_machine, 'transition')
+            guards = {rule_tag['xmi:id']: rule_tag for rule_tag in extractTags(state_machine, 'ownedRule') if rule_tag.has_attr('xmi:id')} # Guards by id.
             for transition_tag in transitions:
-                if transition_tag['source'] in states and transition_tag['target'] in states:
+                source_id, target_id, guard_id = transition_tag.get('source'), transition_tag.get('target'), transition_tag.get('guard')
+                if source_id in states and target_id in states:
                     transition = UmlStateTransition(transition_tag)
-                    transition.next_state = states[transition_tag['target']].name
+                    transition.next_state = states[target_id].name
                     transition.actions = [key for key in extractProperties(transition_tag) if key != 'uuid']
-                    condition = extractTag(extractTag(transition_tag, 'ownedRule', {'xmi:id': transition_tag['guard']}), 'specification')                    
+                    condition = extractTag(guards[guard_id], 'specification') if guard_id in guards else None
                     if condition:
                         transition.condition = condition['value']
-                        states[transition_tag['source']].transitions.append(transition)
+                        states[source_id].transitions.append(transition)
                     else:
-                        raiseException('err7', transition.name)
+                        raiseException('err7', transition.transition_id)
                 else:
-                    raiseException('err8', transition_tag['source'])
+                    raiseException('err8', source_id)
             behaviors[tag_id] = states
+            profiler.count('states', len(states))
+            profiler.count('transitions', len(transitions))
     return behaviors
 
+# Model index, built once: class id -> UmlClass and attribute id -> UmlAttribute.
+# Attributes are indexed by their own id, so the attributes inherited from a mother class are found from any instance slot.
+class ModelIndex:
+    def __init__(self, uml_classes):
+        self.classes = {}
+        self.attributes = {}
+        for uml_class in uml_classes:
+            self.classes[uml_class.class_id] = uml_class
+            for attribute in uml_class.attributes:
+                self.attributes[attribute.attribute_id] = attribute
+
+    def getClass(self, class_id):
+        if class_id not in self.classes:
+            raiseException('err11', class_id)
+        return self.classes[class_id]
+
+    def getAttribute(self, attribute_id):
+        if attribute_id not in self.attributes:
+            raiseException('err12', attribute_id)
+        return self.attributes[attribute_id]
+
 # Instanciation.
-def instanciation(root, uml_classes):
+@profiled('instanciation')
+def instanciation(root, uml_classes, model_index = None):
     instance_tags = extractTags(root, 'packagedElement', {'xsi:type': 'uml:InstanceSpecification'})
-    class_attributes = reduce(lambda acc, curr: acc + curr.attributes, uml_classes, []) # Get all attributes from all classes.
-    instances = []
+    model_index = model_index if model_index else ModelIndex(uml_classes)
+    instances = InstanceTable()
     for instance_tag in instance_tags:
         if instance_tag.has_attr('classifier'):
-            uml_class = list(filter(lambda uml_class: uml_class.class_id == instance_tag['classifier'], uml_classes)) # Get current class.
-            if len(uml_class) == 1:
-                instance = GamlInstance()
-                uml_class = uml_class[0]
-                instance.name = uml_class.name
-                instance.properties = extractProperties(instance_tag)
-                slot_tags = extractTags(instance_tag, 'slot')
-                instance.getHeading()
-                for slot_tag in slot_tags:
-                    value_tag = extractTag(slot_tag, 'value')
-                    if value_tag:
-                        attribute_name = list(filter(lambda attribute: attribute.attribute_id == slot_tag['definingFeature'], class_attributes)) # Get current attribute (some attributes can be in mother classes).
-                        if len(attribute_name) == 1:
-                            attribute_name = attribute_name[0]
-                            instance.attributes[attribute_name.name] = value_tag['symbol']
-                        else:
-                            raiseException('err12', slot_tag['definingFeature'])
-                    else:
-                        raiseException('err10', slot_tag['xmi:id'])
-                instances.append(instance)
-            else:
-                raiseException('err11', instance_tag['classifier'])
+            uml_class = model_index.getClass(instance_tag['classifier']) # Get current class.
+            attributes = {}
+            features = {}
+            for slot_tag in extractChildren(instance_tag, 'slot'):
+                value_tag = extractTag(slot_tag, 'value')
+                if value_tag:
+                    attribute = model_index.getAttribute(slot_tag['definingFeature']) # Get current attribute (some attributes can be in mother classes).
+                    attributes[attribute.name] = value_tag['symbol']
+                    features[attribute.name] = attribute.attribute_id
+                else:
+                    raiseException('err10', slot_tag['xmi:id'])
+            instances.addRow(instance_tag['xmi:id'] if instance_tag.has_attr('xmi:id') else None, uml_class, getModelProperties(instance_tag), attributes, features)
         else:
-            raiseException('err14', instance_tag['classifier'])
-    instances = sorted(instances, key=lambda instance: float(instance.properties['priority']) if instance.properties and 'priority' in instance.properties else float('inf'))
+            raiseException('err14')
+    instances.sort()
+    profiler.count('instances', len(instances))
     return instances
 
+# Instanciation order of an instance (instances without priority are created last).
+def getPriority(instance):
+    return float(instance.properties['priority']) if instance.properties and 'priority' in instance.properties else float('inf')
+
+# Instance compaction.
+literal_patterns = { # Slot values which can be loaded from a csv file, by attribute type.
+    'int'   : re.compile(r'-?\d+$'),
+    'float' : re.compile(r'-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$'),
+    'bool'  : re.compile(r'(true|false)$'),
+    'string': re.compile(r'"[^"]*"$')
+}
+
+# Collapse the instances of a same class with identical headings and slots (names and defining features) into a single create statement.
+# Groups are built between instances of the same priority, so the priority ordering is kept.
+@profiled('compactInstances')
+def compactInstances(instances, model_index, sidecar_prefix):
+    creations = []
+    sidecars = {}
+    for _, priority_instances in groupby(instances, key=getPriority):
+        groups = {}
+        for instance in priority_instances:
+            groups.setdefault((instance.class_id, instance.heading, tuple(instance.features.items())), []).append(instance)
+        for group in groups.values():
+            creations.extend(compactGroup(group, model_index, sidecar_prefix, sidecars))
+    return creations, sidecars
+
+# The instances whose slot values can't be loaded from a csv file (expressions) are left out of it: identical ones are created together, the others one by one.
+def compactGroup(group, model_index, sidecar_prefix, sidecars):
+    first = group[0]
+    if len(group) == 1 or (first.properties and ('number' in first.properties or 'from' in first.properties)): # Already a bulk creation.
+        return group
+    if all(instance.attributes == first.attributes for instance in group):
+        return [compactIdentical(group)]
+    columns = list(first.attributes)
+    column_types = [model_index.getAttribute(first.features[column]) for column in columns]
+    column_types = [None if attribute.is_list else attribute.type for attribute in column_types]
+    loaded = []
+    expressions = {}
+    for instance in group:
+        if all(column_type in literal_patterns and literal_patterns[column_type].match(instance.attributes[column]) for column, column_type in zip(columns, column_types)):
+            loaded.append(instance)
+        else:
+            expressions.setdefault(tuple(instance.attributes.values()), []).append(instance)
+    creations = [compactLoaded(loaded, columns, column_types, sidecar_prefix, sidecars)] if len(loaded) > 1 else loaded
+    for identical in expressions.values():
+        creations.extend([compactIdentical(identical)] if len(identical) > 1 else identical)
+    return creations
+
+def compactIdentical(group):
+    first = group[0]
+    compacted = GamlInstance()
+    compacted.class_id = first.class_id
+    compacted.name = first.name
+    compacted.attributes = first.attributes
+    compacted.heading = ' '.join(filter(None, [f'number: {len(group)}', first.heading]))
+    return compacted
+
+def compactLoaded(group, columns, column_types, sidecar_prefix, sidecars):
+    first = group[0]
+    compacted = GamlInstance()
+    compacted.class_id = first.class_id
+    compacted.name = first.name
+    file_name = f'{sidecar_prefix}_{first.name}_{len(sidecars) + 1}.csv'
+    import csv
+    content = io.StringIO()
+    writer = csv.writer(content, lineterminator='\n')
+    writer.writerow(columns)
+    for instance in group:
+        writer.writerow([instance.attributes[column][1:-1] if column_type == 'string' else instance.attributes[column] for column, column_type in zip(columns, column_types)])
+    sidecars[file_name] = content.getvalue()
+    loaded_columns = ', '.join(['%s::%s(get("%s"))' % (column, column_type, column) for column, column_type in zip(columns, column_types)])
+    compacted.heading = ' '.join(filter(None, ['from: csv_file("%s", true) with: [%s]' % (file_name, loaded_columns), first.heading]))
+    return compacted
+
 # Get global block.
-def getGlobal(root, uml_classes):
+@profiled('getGlobal')
+def getGlobal(root, uml_classes, sidecar_prefix = None): # Instances are compacted when a sidecar prefix is given.
     uml_global = buildClassDiagram(root, 'global')
     if len(uml_global) == 1:
         uml_global = GamlGlobal(uml_global[0].attributes, uml_global[0].operations)
-        for instance in instanciation(xml_tree, uml_classes):
-            uml_global.init.append(instance.translateToGaml())
+        model_index = ModelIndex(uml_classes)
+        instances = instanciation(root, uml_classes, model_index)
+        if sidecar_prefix:
+            uml_global.instances, uml_global.sidecars = compactInstances(instances.instances(), model_index, sidecar_prefix)
+        else:
+            uml_global.instances = instances
         uml_global.initCompletion()
         return uml_global
     elif len(uml_global) > 0:
         raiseException('err9')
 
 # Get experiment block.
+@profiled('getExperiment')
 def getExperiment(root):
     uml_experiment = buildClassDiagram(root, 'experiment')
     if len(uml_experiment) == 1:
@@ -229,7 +902,7 @@ def getExperiment(root):
     elif len(uml_experiment) > 0:
         raiseException('err13')
 
-# Type of an attribute or an operation.
+# Type of an attribute or an operation (the types of the primitive hrefs are cached by the session).
 def getTypeValue(root, class_tags, enumeration_tags): # Some attributes can have no type.
     if root.has_attr('type'):
         if root['type'] in enumeration_tags:
@@ -241,11 +914,16 @@ def getTypeValue(root, class_tags, enumeration_tags): # Some attributes can have
     else:
         type_tag = extractTag(root, 'type')
         if type_tag:
-            m = re.match('.*#//(.*)', type_tag['href'])
+            href = type_tag['href']
+            href_types = getTransformer().href_types
+            if href in href_types:
+                return href_types[href]
+            m = re.match('.*#//(.*)', href)
             if m:
                 attribute_type = m.group(1)
                 if attribute_type in UmlClass.type_conversion:
-                    return UmlClass.type_conversion[attribute_type] # Predefined type.
+                    href_types[href] = UmlClass.type_conversion[attribute_type]
+                    return href_types[href] # Predefined type.
                 else:
                     raiseException('err3', attribute_type, root['name'])
             else:
@@ -291,8 +969,874 @@ def buildJsonFileSkeleton(*args):
     return json_file
     
 
+# Skeleton of the json file read straight from the XMI tree: only the names of the non abstract classes and of their operations are needed, the class diagram is not built.
+# Same content and order as buildJsonFileSkeleton on the built model (species, global block, experiment block).
+def scanJsonFileSkeleton(root):
+    json_file = {}
+    for package_name in ['meta_model', 'global', 'experiment']:
+        class_tags = [tag for tag in extractClasses(extractPackageTag(root, {'name': package_name})).values() if not tag.has_attr('isAbstract')]
+        if package_name != 'meta_model':
+            if len(class_tags) > 1:
+                raiseException('err9' if package_name == 'global' else 'err13')
+            elif len(class_tags) == 0:
+                raiseException('err15', None)
+        for tag in class_tags:
+            class_name = 'global' if package_name == 'global' else getAttributeValue(tag, 'name')
+            json_file[class_name] = {}
+            for operation_tag in extractChildren(tag, 'ownedOperation'):
+                json_file[class_name][getAttributeValue(operation_tag, 'name')] = ''
+    return json_file
+
+# Operation bodies given as a dictionary or as json (str or bytes).
+def readOperations(operations):
+    if isinstance(operations, bytes):
+        operations = operations.decode('utf-8')
+    return json.loads(operations) if isinstance(operations, str) else operations
+
+# Load the content of the operations from the json file (or its content already read, as bytes).
+@profiled('loadOperations')
+def loadOperations(json_file_path):
+    if isinstance(json_file_path, bytes):
+        thread_state.operations = readOperations(json_file_path)
+    elif path.exists(json_file_path):
+        with codecs.open(json_file_path, 'r', encoding='utf-8') as fin:
+            thread_state.operations = json.load(fin)
+    else:
+        raiseException('err1', json_file_path)
+
+@profiled('parse')
+def loadXmi(xmi_file_path, parser = 'stream'): # File path or content already read (bytes).
+    if isinstance(xmi_file_path, bytes):
+        return parseXmi(io.BytesIO(xmi_file_path), parser)
+    if not path.exists(xmi_file_path):
+        raiseException('err1', xmi_file_path)
+    if parser == 'bs4': # Bytes, decoded by bs4 with the encoding declared by the file.
+        with open(xmi_file_path, 'rb') as fin:
+            return parseXmi(fin, parser)
+    return parseXmi(xmi_file_path, parser) # lxml reads the file by itself.
+
+# Build the species, the global block and the experiment block of a XMI tree.
+def buildModel(xml_tree, sidecar_prefix = None):
+    clearFragmentCaches() # Shared within a model only.
+    uml_classes = buildClassDiagram(xml_tree, 'meta_model') # Meta model package.
+    uml_global = getGlobal(xml_tree, uml_classes, sidecar_prefix)
+    uml_experiment = getExperiment(xml_tree)
+    if profiler.enabled:
+        blocks = [block for block in [uml_global, uml_experiment] + uml_classes if block]
+        profiler.count('species', len(uml_classes))
+        profiler.count('attributes', sum(len(block.attributes) for block in blocks))
+        profiler.count('operations', sum(len(block.operations) for block in blocks))
+    return uml_classes, uml_global, uml_experiment
+
+# Model cache.
+# Built models are pickled under the cache directory, keyed by the content of the XMI and json files, the transformer version (with its templates) and the compaction prefix.
+# The warnings raised while building the model are stored with it and raised again on a hit, where neither the XMI file nor bs4 is loaded.
+def getModelKey(xmi_file_path, json_file_path, sidecar_prefix): # File paths or contents (bytes).
+    digest = hashlib.sha1(repr((getManifestVersion(), sidecar_prefix)).encode('utf-8'))
+    for file_path in [xmi_file_path, json_file_path]:
+        if isinstance(file_path, bytes):
+            digest.update(file_path)
+        else:
+            with open(file_path, 'rb') as fin:
+                for block in iter(lambda: fin.read(1 << 20), b''):
+                    digest.update(block)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def readCachedModel(cache_file_path):
+    try:
+        with open(cache_file_path, 'rb') as fin:
+            model, model_warnings = pickle.load(fin)
+    except Exception: # Unreadable or outdated entry, the model is built again.
+        return None
+    os.utime(cache_file_path) # Most recently used.
+    for message in model_warnings:
+        profiler.count('warnings')
+        warnings.warn(message)
+    return model
+
+def writeCachedModel(cache_directory, cache_file_path, model, model_warnings, cache_size):
+    os.makedirs(cache_directory, exist_ok=True)
+    temporary_file_path = f'{cache_file_path}.{os.getpid()}.tmp' # Batch workers can write the same entry.
+    with open(temporary_file_path, 'wb') as fout:
+        pickle.dump((model, model_warnings), fout, pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_file_path, cache_file_path)
+    evictCachedModels(cache_directory, cache_size)
+
+# Remove the least recently used entries until the cache fits in cache_size bytes.
+def evictCachedModels(cache_directory, cache_size):
+    entries = []
+    for file_name in os.listdir(cache_directory):
+        if file_name.endswith('.pickle'):
+            try:
+                stat = os.stat(path.join(cache_directory, file_name))
+            except OSError: # Removed by another process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path.join(cache_directory, file_name)))
+    total_size = sum(entry[1] for entry in entries)
+    for _, size, file_path in sorted(entries):
+        if total_size <= cache_size:
+            break
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+        total_size -= size
+
+# Build the model of a XMI file, or load it from the cache directory when given (files given by path or content).
+def loadModel(xmi_file_path, json_file_path, parser = 'stream', sidecar_prefix = None, cache_directory = None, cache_size = 256 * 2**20):
+    if cache_directory:
+        for file_path in [xmi_file_path, json_file_path]:
+            if not isinstance(file_path, bytes) and not path.exists(file_path):
+                raiseException('err1', file_path)
+        cache_file_path = path.join(cache_directory, f'{getModelKey(xmi_file_path, json_file_path, sidecar_prefix)}.pickle')
+        model = readCachedModel(cache_file_path) if path.exists(cache_file_path) else None
+        if model is not None:
+            profiler.count('model cache hits')
+            return model
+        profiler.count('model cache misses')
+    xml_tree = loadXmi(xmi_file_path, parser)
+    loadOperations(json_file_path)
+    with warnings.catch_warnings(record=True) as model_warnings:
+        warnings.simplefilter('always')
+        model = buildModel(xml_tree, sidecar_prefix)
+    del xml_tree
+    releaseXmi()
+    for model_warning in model_warnings:
+        warnings.warn(model_warning.message)
+    if cache_directory:
+        writeCachedModel(cache_directory, cache_file_path, model, [str(model_warning.message) for model_warning in model_warnings], cache_size)
+    return model
+
+# Write the gaml code fragment by fragment to a file or to the standard output (-).
+@profiled('write')
+def writeGaml(output_file_path, model_name, uml_classes, uml_global, uml_experiment, jobs = None): # Blocks are rendered by a process pool when jobs > 1.
+    if uml_global:
+        for file_name in uml_global.sidecars:
+            with codecs.open(path.join(path.dirname(output_file_path) if output_file_path != '-' else '', file_name), 'w', encoding='utf-8') as fout:
+                fout.write(uml_global.sidecars[file_name])
+    if output_file_path == '-':
+        streamGaml(sys.stdout, model_name, uml_classes, uml_global, uml_experiment, jobs)
+    else:
+        with codecs.open(output_file_path, 'w', encoding='utf-8') as fout:
+            streamGaml(fout, model_name, uml_classes, uml_global, uml_experiment, jobs)
+
+def streamGaml(fout, model_name, uml_classes, uml_global, uml_experiment, jobs = None):
+    fout.write(f'model {model_name}\n')
+    blocks = [block for block in [uml_global, uml_experiment] + uml_classes if block]
+    if jobs and jobs > 1:
+        for fragment in renderFragments(blocks, jobs):
+            fout.write(fragment)
+            fout.write('\n')
+        return
+    for block in blocks:
+        fout.writelines(block.generateGaml())
+        fout.write('\n')
+
+# Parallel rendering.
+# The model objects only hold plain data (no parsed tree): they are pickled to the worker processes and the fragments are gathered back in the output order.
+# The instances of the global block are rendered by chunks, the global block itself is then rendered around them.
+def renderTask(task):
+    if isinstance(task, list):
+        return [instance.translateToGaml() for instance in task]
+    return task.translateToGaml()
+
+def initRenderWorker(cache_directory):
+    configureTemplates(cache_directory)
+
+@profiled('render')
+def renderFragments(blocks, jobs = None):
+    if not jobs or jobs < 2:
+        return [block.translateToGaml() for block in blocks]
+    tasks = []
+    chunks = {} # Number of instance chunks of the global block.
+    for block in blocks:
+        if isinstance(block, GamlGlobal) and not isinstance(block.instances, InstanceTable): # An instance table is formatted without templates, it is rendered with its global block.
+            chunk_size = max(1, -(-len(block.instances) // (jobs * 4)))
+            instance_chunks = [block.instances[i:i + chunk_size] for i in range(0, len(block.instances), chunk_size)]
+            chunks[id(block)] = len(instance_chunks)
+            tasks.extend(instance_chunks)
+        else:
+            tasks.append(block)
+    from concurrent.futures import ProcessPoolExecutor
+    bytecode_cache = getTemplateEnvironment().bytecode_cache
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initRenderWorker, initargs=(bytecode_cache.directory if bytecode_cache else None,)) as executor:
+        results = iter(executor.map(renderTask, tasks))
+        fragments = []
+        for block in blocks:
+            if id(block) in chunks:
+                rendered_global = copy.copy(block)
+                rendered_global.instances = [fragment for _ in range(chunks[id(block)]) for fragment in next(results)]
+                rendered_global.initCompletion()
+                fragments.append(rendered_global.translateToGaml())
+            else:
+                fragments.append(next(results))
+    profiler.count('parallel tasks', len(tasks))
+    return fragments
+
+def getSidecarPrefix(model_name, output_file_path):
+    return model_name if output_file_path == '-' else path.splitext(path.basename(output_file_path))[0]
+
+# Transform a XMI file and its json file into a gaml file.
+def transformModel(xmi_file_path, json_file_path, model_name, output_file_path, parser = 'stream', compact_instances = False, incremental = False, jobs = None, cache_directory = None, cache_size = 256 * 2**20):
+    sidecar_prefix = getSidecarPrefix(model_name, output_file_path) if compact_instances else None
+    if incremental:
+        xml_tree = loadXmi(xmi_file_path, parser)
+        loadOperations(json_file_path)
+        transformIncremental(xml_tree, model_name, output_file_path, sidecar_prefix, jobs)
+    else:
+        writeGaml(output_file_path, model_name, *loadModel(xmi_file_path, json_file_path, parser, sidecar_prefix, cache_directory, cache_size), jobs)
+
+# Resolve again the content of the operations after a reload of the json file.
+def refreshOperations(uml_classes, uml_global, uml_experiment):
+    for block in [uml_global, uml_experiment] + uml_classes:
+        if block:
+            for operation in block.operations:
+                operation.content = operation.getContent()
+    if uml_global:
+        uml_global.initCompletion()
+
+# Watch mode.
+def getModificationTimes(file_paths):
+    return [os.stat(file_path).st_mtime_ns if path.exists(file_path) else None for file_path in file_paths]
+
+# Keep the parsed model and the compiled templates in memory and regenerate the gaml file when the XMI or the json file changes.
+# Only the operations are refreshed when the json file alone changed.
+def watchModel(xmi_file_path, json_file_path, model_name, output_file_path, parser = 'stream', compact_instances = False, poll_interval = 0.2, debounce = 0.1):
+    sidecar_prefix = getSidecarPrefix(model_name, output_file_path) if compact_instances else None
+    file_paths = [xmi_file_path, json_file_path]
+    model = None
+    known_times = [None, None]
+    print(f'Watching {xmi_file_path} and {json_file_path} (Ctrl+C to stop).')
+    while True:
+        modification_times = getModificationTimes(file_paths)
+        if modification_times != known_times:
+            while True: # Wait for the end of the burst of writes of the editor.
+                time.sleep(debounce)
+                settled_times = getModificationTimes(file_paths)
+                if settled_times == modification_times:
+                    break
+                modification_times = settled_times
+            start_time = time.time()
+            try:
+                loadOperations(json_file_path)
+                if model is None or modification_times[0] != known_times[0]:
+                    model = buildModel(loadXmi(xmi_file_path, parser), sidecar_prefix)
+                    releaseXmi()
+                    change = 'model'
+                else:
+                    refreshOperations(*model)
+                    change = 'operations'
+                writeGaml(output_file_path, model_name, *model)
+                print(f'{model_name} regenerated ({change}) in {round((time.time() - start_time) * 1000, 1)} ms.')
+            except Exception as exception:
+                print(f'{model_name} failed: {exception}')
+            known_times = modification_times
+        time.sleep(poll_interval)
+
+# Incremental regeneration.
+# The manifest stored next to the output keeps, for the global block, the experiment block and each species, the hash of its inputs and its rendered fragment.
+def getChildren(root):
+    return root.children if isinstance(root, XmiNode) else [child for child in root.children if child.name is not None] # Strings have no name.
+
+def hashTag(root, digest, excluded_tags = ()):
+    stack = [(root, 0)]
+    while stack:
+        tag, depth = stack.pop()
+        digest.update(repr((depth, tag.name, tag.attrs, tag.properties if isinstance(tag, XmiNode) else None)).encode('utf-8'))
+        stack.extend(reversed([(child, depth + 1) for child in getChildren(tag) if child.name not in excluded_tags]))
+    return digest
+
+def hashOperations(class_names, digest):
+    digest.update(json.dumps([thread_state.operations.get(class_name) for class_name in class_names], sort_keys=True).encode('utf-8'))
+    return digest
+
+def getManifestVersion():
+    return hashlib.sha1(repr((__version__, source_digest, sorted(getTemplateSources().items()))).encode('utf-8')).hexdigest()
+
+# Input hashes of the fragments, in output order: global, experiment and the species (class id).
+@profiled('hash fragments')
+def getFragmentHashes(root, sidecar_prefix):
+    hashes = {}
+    meta_model_package = extractPackageTag(root, {'name': 'meta_model'})
+    class_tags = extractClasses(meta_model_package)
+    controller_tags = {tag['xmi:id']: tag for tag in extractPackageTags(meta_model_package)}
+    dependancy_links = dependancyLink(meta_model_package)
+    context = repr(([(tag_id, class_tags[tag_id].get('name'), class_tags[tag_id].has_attr('isAbstract')) for tag_id in class_tags], list(extractEnumerations(meta_model_package)))).encode('utf-8') # Names used to resolve types and parents.
+    global_digest = hashlib.sha1(repr(sidecar_prefix).encode('utf-8'))
+    global_package = extractPackageTag(root, {'name': 'global'})
+    hashTag(global_package, global_digest)
+    hashOperations([tag.get('name') for tag in extractClasses(global_package).values()], global_digest)
+    for instance_tag in extractTags(root, 'packagedElement', {'xsi:type': 'uml:InstanceSpecification'}):
+        hashTag(instance_tag, global_digest)
+    experiment_digest = hashlib.sha1()
+    experiment_package = extractPackageTag(root, {'name': 'experiment'})
+    hashTag(experiment_package, experiment_digest)
+    hashOperations([tag.get('name') for tag in extractClasses(experiment_package).values()], experiment_digest)
+    class_hashes = {}
+    for tag_id in class_tags:
+        tag = class_tags[tag_id]
+        if not tag.has_attr('isAbstract'):
+            hashTag(tag, global_digest, ('ownedOperation',)) # Instances depend on the classes and their attributes.
+            class_digest = hashTag(tag, hashlib.sha1(context))
+            hashOperations([tag.get('name')], class_digest)
+            if tag_id in dependancy_links:
+                hashTag(controller_tags[dependancy_links[tag_id]], class_digest)
+            class_hashes[tag_id] = class_digest.hexdigest()
+    hashes['global'] = global_digest.hexdigest()
+    hashes['experiment'] = experiment_digest.hexdigest()
+    hashes.update(class_hashes)
+    return hashes
+
+def readManifest(manifest_file_path):
+    if path.exists(manifest_file_path):
+        try:
+            with codecs.open(manifest_file_path, 'r', encoding='utf-8') as fin:
+                manifest = json.load(fin)
+            if manifest.get('version') == getManifestVersion():
+                return manifest['fragments']
+        except ValueError: # Corrupted manifest, everything is rendered again.
+            pass
+    return {}
+
+# Render only the fragments whose inputs changed since the last run and splice the output back together.
+def transformIncremental(xml_tree, model_name, output_file_path, sidecar_prefix = None, jobs = None):
+    manifest_file_path = f'{output_file_path}.manifest'
+    fragments = readManifest(manifest_file_path) if path.exists(output_file_path) else {}
+    hashes = getFragmentHashes(xml_tree, sidecar_prefix)
+    output_directory = path.dirname(output_file_path)
+    stale = set()
+    profiler.count('fragments', len(hashes))
+    for key in hashes:
+        if key not in fragments or fragments[key]['hash'] != hashes[key] or not all(path.exists(path.join(output_directory, file_name)) for file_name in fragments[key].get('sidecars', [])):
+            stale.add(key)
+    profiler.count('fragment cache hits', len(hashes) - len(stale))
+    if stale:
+        class_ids = None if 'global' in stale else stale # Instanciation needs all the classes.
+        uml_classes = buildClassDiagram(xml_tree, 'meta_model', class_ids)
+        stale_blocks = {uml_class.class_id: uml_class for uml_class in uml_classes if uml_class.class_id in stale}
+        if 'global' in stale:
+            uml_global = getGlobal(xml_tree, uml_classes, sidecar_prefix)
+            stale_blocks['global'] = uml_global
+            if uml_global:
+                for file_name in uml_global.sidecars:
+                    with codecs.open(path.join(output_directory, file_name), 'w', encoding='utf-8') as fout:
+                        fout.write(uml_global.sidecars[file_name])
+        if 'experiment' in stale:
+            stale_blocks['experiment'] = getExperiment(xml_tree)
+        rendered_keys = [key for key in stale_blocks if stale_blocks[key]]
+        rendered_fragments = dict(zip(rendered_keys, renderFragments([stale_blocks[key] for key in rendered_keys], jobs)))
+        for key in stale_blocks:
+            fragments[key] = {'gaml': rendered_fragments.get(key)}
+        if 'global' in stale:
+            fragments['global']['sidecars'] = list(uml_global.sidecars) if uml_global else []
+        for key in stale:
+            fragments[key]['hash'] = hashes[key]
+    if stale or list(fragments) != list(hashes) or fragments['global'].get('model_name') != model_name:
+        fragments['global']['model_name'] = model_name
+        with codecs.open(output_file_path, 'w', encoding='utf-8') as fout:
+            fout.write(f'model {model_name}\n')
+            for key in hashes:
+                if fragments[key]['gaml'] is not None:
+                    fout.write(fragments[key]['gaml'] + '\n')
+        with codecs.open(manifest_file_path, 'w', encoding='utf-8') as fout:
+            json.dump({'version': getManifestVersion(), 'fragments': {key: fragments[key] for key in hashes}}, fout)
+    return stale
+
+# Batch mode.
+# XMI files of a directory or a glob pattern, each one with its json file (same directory or data/gama like directory) and its output file.
+def findModels(pattern, output_directory, json_directory = None):
+    import glob
+    xmi_file_paths = sorted(glob.glob(path.join(pattern, '*.xmi') if path.isdir(pattern) else pattern))
+    models = []
+    for xmi_file_path in xmi_file_paths:
+        model_name = path.splitext(path.basename(xmi_file_path))[0]
+        models.append((xmi_file_path, findJsonFile(xmi_file_path, json_directory), model_name, path.join(output_directory, f'{model_name}.gaml')))
+    return models
+
+def findJsonFile(xmi_file_path, json_directory = None):
+    model_name = path.splitext(path.basename(xmi_file_path))[0]
+    if json_directory:
+        return path.join(json_directory, f'{model_name}.json')
+    json_file_path = path.join(path.dirname(xmi_file_path), f'{model_name}.json')
+    if not path.exists(json_file_path):
+        json_file_path = path.join(path.dirname(path.dirname(xmi_file_path)), 'gama', f'{model_name}.json')
+    return json_file_path
+
+# Run in a worker process: errors and warnings are reported instead of raised.
+def transformBatchModel(xmi_file_path, json_file_path, model_name, output_file_path, parser = 'stream', compact_instances = False, incremental = False, cache_directory = None, cache_size = 256 * 2**20):
+    start_time = time.time()
+    error = None
+    with warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter('always')
+        try:
+            transformModel(xmi_file_path, json_file_path, model_name, output_file_path, parser, compact_instances, incremental, None, cache_directory, cache_size)
+        except Exception as exception:
+            error = f'{type(exception).__name__}: {exception}'
+    return model_name, time.time() - start_time, error, [str(warning.message) for warning in caught_warnings]
+
+def transformBatch(models, workers = None, parser = 'stream', compact_instances = False, incremental = False, cache_directory = None, cache_size = 256 * 2**20):
+    from concurrent.futures import ProcessPoolExecutor
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(transformBatchModel, *model, parser, compact_instances, incremental, cache_directory, cache_size) for model in models]
+        for model, future in zip(models, futures):
+            try:
+                results.append(future.result())
+            except Exception as exception: # Worker process failure.
+                results.append((model[2], 0.0, f'{type(exception).__name__}: {exception}', []))
+    return results
+
+# Asynchronous batch pipeline: the XMI and json files are prefetched, transformed by a process pool and the gaml files are written, each stage feeding the next one through a bounded queue.
+# Reads and writes overlap the transformations.
+def readBytes(file_path):
+    try:
+        with open(file_path, 'rb') as fin:
+            return fin.read()
+    except OSError: # Reported as missing by the transformation.
+        return None
+
+def transformPipelineModel(xmi_file_path, json_file_path, model_name, output_file_path, xmi_content, json_content, parser = 'stream', compact_instances = False, cache_directory = None, cache_size = 256 * 2**20):
+    start_time = time.time()
+    error = None
+    fragments = None
+    with warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter('always')
+        try:
+            for file_path, content in [(xmi_file_path, xmi_content), (json_file_path, json_content)]:
+                if content is None:
+                    raiseException('err1', file_path)
+            model = loadModel(xmi_content, json_content, parser, getSidecarPrefix(model_name, output_file_path) if compact_instances else None, cache_directory, cache_size)
+            fout = io.StringIO()
+            streamGaml(fout, model_name, *model)
+            fragments = (fout.getvalue(), model[1].sidecars if model[1] else {})
+        except Exception as exception:
+            error = f'{type(exception).__name__}: {exception}'
+    return (model_name, time.time() - start_time, error, [str(warning.message) for warning in caught_warnings]), fragments
+
+def writePipelineModel(output_file_path, fragments):
+    gaml, sidecars = fragments
+    for file_name in sidecars:
+        with codecs.open(path.join(path.dirname(output_file_path), file_name), 'w', encoding='utf-8') as fout:
+            fout.write(sidecars[file_name])
+    with codecs.open(output_file_path, 'w', encoding='utf-8') as fout:
+        fout.write(gaml)
+
+async def runPipeline(models, workers, parser, compact_instances, cache_directory, cache_size, queue_size):
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    loop = asyncio.get_running_loop()
+    workers = workers if workers else os.cpu_count() or 1
+    read_queue = asyncio.Queue(queue_size)
+    write_queue = asyncio.Queue(queue_size)
+    results = [None] * len(models)
+
+    async def read(file_path):
+        return await loop.run_in_executor(None, readBytes, file_path)
+
+    async def prefetch(pending): # Several readers so that the latencies of the reads overlap.
+        for i_model in pending:
+            xmi_content, json_content = await asyncio.gather(read(models[i_model][0]), read(models[i_model][1]))
+            await read_queue.put((i_model, xmi_content, json_content))
+
+    async def prefetchAll():
+        pending = iter(range(len(models)))
+        await asyncio.gather(*[prefetch(pending) for _ in range(queue_size)])
+        for _ in range(workers):
+            await read_queue.put(None)
+
+    async def transform(executor):
+        while True:
+            item = await read_queue.get()
+            if item is None:
+                break
+            i_model, xmi_content, json_content = item
+            try:
+                result = await loop.run_in_executor(executor, transformPipelineModel, *models[i_model], xmi_content, json_content, parser, compact_instances, cache_directory, cache_size)
+            except Exception as exception: # Worker process failure.
+                result = ((models[i_model][2], 0.0, f'{type(exception).__name__}: {exception}', []), None)
+            await write_queue.put((i_model, result))
+
+    async def write():
+        while True:
+            item = await write_queue.get()
+            if item is None:
+                break
+            i_model, (result, fragments) = item
+            if fragments is not None:
+                try:
+                    await loop.run_in_executor(None, writePipelineModel, models[i_model][3], fragments)
+                except OSError as exception:
+                    result = result[:2] + (f'{type(exception).__name__}: {exception}',) + result[3:]
+            results[i_model] = result
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        writer = asyncio.ensure_future(write())
+        await asyncio.gather(prefetchAll(), *[transform(executor) for _ in range(workers)])
+        await write_queue.put(None)
+        await writer
+    return results
+
+def transformPipeline(models, workers = None, parser = 'stream', compact_instances = False, cache_directory = None, cache_size = 256 * 2**20, queue_size = 4):
+    import asyncio
+    return asyncio.run(runPipeline(models, workers, parser, compact_instances, cache_directory, cache_size, queue_size))
+
+def printBatchSummary(results):
+    for model_name, duration, error, model_warnings in results:
+        status = f'failed ({error})' if error else 'ok'
+        print(f'{model_name:<30} {round(duration, 3):>8}s {len(model_warnings):>3} warning(s) {status}')
+    failures = [result for result in results if result[2]]
+    print(f'{len(results) - len(failures)}/{len(results)} models transformed, {len(failures)} failed.')
+
+# Model diff.
+# The blocks and their elements (attributes, operations, states and their transitions, instances) of two revisions are matched by xmi:id through dictionaries, so the diff is linear in the size of the models.
+# Only the changed elements are rendered, a whole species only when it is added or removed (or when its heading changed).
+def diffById(old_items, new_items): # Items: (id, key compared between the revisions, element).
+    old_index = {item_id: (key, element) for item_id, key, element in old_items}
+    changes = []
+    for item_id, key, element in new_items:
+        old_item = old_index.pop(item_id, None)
+        if old_item is None:
+            changes.append(('added', None, element))
+        elif old_item[0] != key:
+            changes.append(('modified', old_item[1], element))
+    changes.extend(('removed', element, None) for _, element in old_index.values())
+    return changes
+
+def getBlocks(uml_classes, uml_global, uml_experiment): # Same order as the gaml file.
+    blocks = [('global', uml_global), ('experiment', uml_experiment)] + [(uml_class.class_id, uml_class) for uml_class in uml_classes]
+    return [(block_id, block) for block_id, block in blocks if block]
+
+def getBlockHeader(block):
+    if isinstance(block, UmlClass):
+        return block.name, block.type, block.parent, block.heading
+    if isinstance(block, GamlExperiment):
+        return block.name, block.heading
+
+# Changes of the elements of a block: (kind, change, old element, new element, changes of the transitions of a state).
+def diffBlock(old_block, new_block):
+    changes = []
+    attribute_items = lambda block: [(attribute.attribute_id, tuple(getattr(attribute, field) for field in UmlAttribute.template_fields) + (attribute.is_static,), attribute) for attribute in block.attributes]
+    changes.extend(('attribute',) + change + ([],) for change in diffById(attribute_items(old_block), attribute_items(new_block)))
+    operation_items = lambda block: [(operation.operation_id, tuple(getattr(operation, field) for field in UmlOperation.template_fields), operation) for operation in block.operations]
+    changes.extend(('operation',) + change + ([],) for change in diffById(operation_items(old_block), operation_items(new_block)))
+    if isinstance(new_block, UmlClass):
+        state_items = lambda block: [(state.state_id, rendered_state, (state, rendered_state)) for state, rendered_state in zip(block.states, block.controllers)]
+        transition_items = lambda state: [(transition.transition_id, (transition.next_state, transition.condition, transition.actions), transition) for transition in state[0].transitions] if state else []
+        for change, old_state, new_state in diffById(state_items(old_block), state_items(new_block)):
+            transition_changes = diffById(transition_items(old_state), transition_items(new_state))
+            changes.append(('state', change, old_state, new_state, transition_changes))
+    if isinstance(new_block, GamlGlobal):
+        changes.extend(('instance',) + change + ([],) for change in diffInstances(old_block.instances, new_block.instances))
+    return changes
+
+# Same as diffById on the rows of two instance tables, without building an item for each row (instances without id are matched by position).
+def diffInstances(old_table, new_table):
+    row_id = lambda table, row: table.instance_ids[row] if table.instance_ids[row] is not None else ('row', row)
+    old_rows = {row_id(old_table, row): row for row in old_table.order}
+    changes = []
+    for row in new_table.order:
+        old_row = old_rows.pop(row_id(new_table, row), None)
+        if old_row is None:
+            changes.append(('added', None, (new_table, row)))
+        elif old_table.getRowKey(old_row) != new_table.getRowKey(row):
+            changes.append(('modified', (old_table, old_row), (new_table, row)))
+    changes.extend(('removed', (old_table, row), None) for row in old_rows.values())
+    return changes
+
+# Changes of the blocks: (change, old block, new block, changes of the elements).
+@profiled('diff')
+def diffModels(old_model, new_model):
+    old_blocks = dict(getBlocks(*old_model))
+    changes = []
+    for block_id, new_block in getBlocks(*new_model):
+        old_block = old_blocks.pop(block_id, None)
+        if old_block is None:
+            changes.append(('added', None, new_block, []))
+        else:
+            element_changes = diffBlock(old_block, new_block)
+            if element_changes or getBlockHeader(old_block) != getBlockHeader(new_block):
+                changes.append(('modified', old_block, new_block, element_changes))
+    changes.extend(('removed', old_block, None, []) for old_block in old_blocks.values())
+    return changes
+
+def getElementLabel(kind, element):
+    if kind == 'state':
+        return f'state {element[0].name} ({element[0].state_id})'
+    if kind == 'instance':
+        table, row = element
+        return f'instance {table.class_names[table.classes[row]]} ({table.instance_ids[row]})'
+    if kind == 'attribute':
+        return f'attribute {element.name} ({element.attribute_id})'
+    return f'operation {element.name} ({element.operation_id})'
+
+def renderElement(kind, element):
+    if element is None:
+        return None
+    if kind == 'state':
+        return element[1]
+    if kind == 'instance':
+        table, row = element
+        return table.formatRow(row)
+    return element.translateToGaml()
+
+def getBlockLabel(block):
+    if isinstance(block, UmlClass):
+        return f'{block.type if block.type else "species"} {block.name} ({block.class_id})'
+    return f'{block.name}' if isinstance(block, GamlGlobal) else f'experiment {block.name}'
+
+# Lines of a fragment without the blank lines, the first line and the following ones are dedented apart (the rendered states are stripped).
+def getFragmentLines(fragment):
+    import textwrap
+    lines = [line.rstrip() for line in fragment.splitlines() if line.strip()] if fragment else []
+    return lines[:1] and [lines[0].lstrip()] + textwrap.dedent('\n'.join(lines[1:])).splitlines()
+
+# Unified diff lines of two fragments (None when the element is missing on one side).
+def diffFragments(old_fragment, new_fragment):
+    import difflib
+    old_lines, new_lines = getFragmentLines(old_fragment), getFragmentLines(new_fragment)
+    return list(difflib.unified_diff(old_lines, new_lines, lineterm='', n=len(old_lines) + len(new_lines)))[3:]
+
+@profiled('write')
+def writeDiff(fout, old_label, new_label, changes):
+    fout.write(f'--- {old_label}\n+++ {new_label}\n')
+    counts = {'added': 0, 'removed': 0, 'modified': 0}
+    for change, old_block, new_block, element_changes in changes:
+        block = new_block if new_block else old_block
+        fout.write(f'@@ {getBlockLabel(block)} {change} @@\n')
+        if change != 'modified' or getBlockHeader(old_block) != getBlockHeader(new_block):
+            counts[change] += 1
+            block_lines = diffFragments(old_block.translateToGaml() if old_block else None, new_block.translateToGaml() if new_block else None)
+            if change == 'modified': # Heading only, the elements follow.
+                block_lines = [line for line in block_lines if line[0] != ' '][:2]
+            fout.writelines(line + '\n' for line in block_lines)
+        for kind, element_change, old_element, new_element, transition_changes in element_changes:
+            counts[element_change] += 1
+            label = getElementLabel(kind, new_element if new_element else old_element)
+            details = ', '.join(f'transition {(new_transition if new_transition else old_transition).transition_id} {transition_change}' for transition_change, old_transition, new_transition in transition_changes)
+            fout.write(f'// {label} {element_change}{": " + details if details else ""}\n')
+            fout.writelines(line + '\n' for line in diffFragments(renderElement(kind, old_element), renderElement(kind, new_element)))
+    fout.write(f'// {counts["added"]} added, {counts["removed"]} removed, {counts["modified"]} modified\n')
+    return sum(counts.values())
+
+# Diff of the models of two XMI files, each one with its json file; both models go through the model cache, so the unchanged revision is not parsed again.
+def diffModel(old_xmi_file_path, new_xmi_file_path, output_file_path, json_directory = None, parser = 'stream', cache_directory = None, cache_size = 256 * 2**20):
+    models = [loadModel(xmi_file_path, findJsonFile(xmi_file_path, json_directory), parser, None, cache_directory, cache_size) for xmi_file_path in [old_xmi_file_path, new_xmi_file_path]]
+    changes = diffModels(*models)
+    if output_file_path == '-':
+        return writeDiff(sys.stdout, old_xmi_file_path, new_xmi_file_path, changes)
+    with codecs.open(output_file_path, 'w', encoding='utf-8') as fout:
+        return writeDiff(fout, old_xmi_file_path, new_xmi_file_path, changes)
+
+# Validation (--check).
+# The XMI file is read once by lxml iterparse, only the packagedElement tags reaching Python: each one is checked when it ends, with its subtree, then cleared.
+# Nothing is built nor rendered, every diagnostic of the transformation is collected (code, message, element id and line in the XMI file) instead of stopping at the first error;
+# the references to classes, enumerations and attributes are resolved once the whole file is read.
+class ModelChecker:
+    scope_names = ('meta_model', 'global', 'experiment') # Packages built by the transformation.
+    xsi_type = '{http://www.w3.org/2001/XMLSchema-instance}type'
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.diagnostics = [] # (line, severity, code, element id, message).
+        self.xmi_namespace = 'http://www.omg.org/spec/XMI/20131001'
+        self.type_prefixes = {} # Prefixes of the known namespaces declared under other prefixes (xsi:type values).
+        self.stack = [] # Open packagedElement tags: [xsi:type, enclosing scopes, scopes of the children, diagnostics of the first state machine, scope of the children classes].
+        self.scopes = {} # Scope name -> (package id, line) of the first package with this name.
+        self.class_names = {name: {} for name in ModelChecker.scope_names} # Class id -> name (abstract classes included).
+        self.enumeration_ids = {name: set() for name in ModelChecker.scope_names}
+        self.class_counts = {name: 0 for name in ModelChecker.scope_names} # Built (non abstract) classes.
+        self.model_class_ids = set() # Built classes and attributes of the meta model (instance classifiers and slots).
+        self.model_attribute_ids = set()
+        self.types = [] # Deferred type references: (scope, type id, element name, element id, line).
+        self.instances = [] # (classifier, instance id, line, [(defining feature, slot id, line, has value)]).
+
+    def getId(self, element):
+        return element.get('{%s}id' % self.xmi_namespace)
+
+    def getAttribute(self, element, attribute_name):
+        return self.getId(element) if attribute_name == 'xmi:id' else element.get(attribute_name)
+
+    def diagnostic(self, severity, code, element, *args):
+        messages = error_codes if severity == 'error' else warning_codes
+        return (element.sourceline if element is not None else None, severity, code, self.getId(element) if element is not None else None, messages[code](*args))
+
+    def error(self, code, element, *args):
+        self.diagnostics.append(self.diagnostic('error', code, element, *args))
+
+    def warning(self, code, element, *args):
+        self.diagnostics.append(self.diagnostic('warning', code, element, *args))
+
+    def checkAttributes(self, element, attribute_names, diagnostics = None): # warn1, as getAttributeValue.
+        for attribute_name in attribute_names:
+            if self.getAttribute(element, attribute_name) is None:
+                (self.diagnostics if diagnostics is None else diagnostics).append(self.diagnostic('warning', 'warn1', element, element.get('name'), attribute_name))
+
+    def start(self, element):
+        parent_scopes = self.stack[-1][2] if self.stack else ()
+        element_type, name = canonicalType(element.get(ModelChecker.xsi_type), self.type_prefixes), element.get('name')
+        scopes, class_scope = parent_scopes, None
+        if element_type == 'uml:Package' and name in ModelChecker.scope_names and name not in self.scopes:
+            self.scopes[name] = (self.getId(element), element.sourceline)
+            scopes, class_scope = parent_scopes + (name,), name
+        self.stack.append([element_type, parent_scopes, scopes, None, class_scope])
+
+    def end(self, element):
+        element_type, scopes, _, machine_diagnostics, _ = self.stack.pop()
+        class_scope = self.stack[-1][4] if self.stack else None # Classes and enumerations are those of the package itself.
+        if element_type == 'uml:Class' and class_scope:
+            self.checkClass(element, class_scope)
+        elif element_type == 'uml:Enumeration' and class_scope:
+            self.enumeration_ids[class_scope].add(self.getId(element))
+        elif element_type == 'uml:StateMachine': # Only the first state machine of a behavior package is transformed.
+            diagnostics = None
+            for record in self.stack:
+                if record[0] == 'uml:Package' and record[3] is None:
+                    diagnostics = diagnostics if diagnostics is not None else self.checkStateMachine(element)
+                    record[3] = diagnostics
+        elif element_type == 'uml:Package':
+            if machine_diagnostics and scopes and self.isBehavior(element):
+                self.diagnostics.extend(machine_diagnostics)
+        elif element_type == 'uml:InstanceSpecification':
+            self.checkInstance(element)
+        element.clear(keep_tail=True)
+
+    def isBehavior(self, package):
+        extension = package.find('{%s}Extension' % self.xmi_namespace)
+        return extension is not None and any(detail.get('key') == 'behavior' for detail in extension.iter('details'))
+
+    def checkType(self, element, scope): # Same cases as getTypeValue.
+        if element.get('type') is not None:
+            self.types.append((scope, element.get('type'), element.get('name'), self.getId(element), element.sourceline))
+        else:
+            type_tag = next(element.iter('type'), None)
+            if type_tag is not None:
+                m = re.match('.*#//(.*)', type_tag.get('href', ''))
+                if not m:
+                    self.error('err4', element, element.get('name'))
+                elif m.group(1) not in UmlClass.type_conversion:
+                    self.error('err3', element, m.group(1), element.get('name'))
+
+    def checkClass(self, element, scope):
+        name = element.get('name')
+        self.class_names[scope][self.getId(element)] = name
+        if element.get('isAbstract') is not None:
+            return
+        self.class_counts[scope] += 1
+        if scope == 'meta_model':
+            self.model_class_ids.add(self.getId(element))
+        self.checkAttributes(element, ('xmi:id', 'name'))
+        if sum(1 for _ in element.iterchildren('generalization')) > 1:
+            self.error('err2', element, name)
+        for attribute in element.iterchildren('ownedAttribute'):
+            self.checkAttributes(attribute, ('xmi:id', 'name', 'visibility'))
+            if scope == 'meta_model':
+                self.model_attribute_ids.add(self.getId(attribute))
+            self.checkType(attribute, scope)
+        for operation in element.iterchildren('ownedOperation'):
+            operation_name, parent = operation.get('name'), operation.getparent()
+            self.checkAttributes(operation, ('xmi:id', 'name'))
+            self.checkAttributes(parent, ('name',))
+            if self.operations and (parent.get('name') not in self.operations or operation_name not in self.operations[parent.get('name')]):
+                self.warning('warn3', operation, operation_name, parent.get('name'))
+            parameters = list(operation.iterchildren('ownedParameter'))
+            return_parameters = [parameter for parameter in parameters if parameter.get('direction') == 'return']
+            if len(return_parameters) > 1:
+                self.warning('warn2', operation, operation_name)
+            elif len(return_parameters) == 1:
+                self.checkType(return_parameters[0], scope)
+            for parameter in parameters:
+                if parameter.get('name') is not None and parameter.get('direction') != 'return':
+                    self.checkType(parameter, scope)
+
+    def checkStateMachine(self, element): # Diagnostics kept until the package is known as a behavior.
+        diagnostics = []
+        states = set()
+        for vertex in element.iter('subvertex'):
+            self.checkAttributes(vertex, ('xmi:id', 'name'), diagnostics)
+            states.add(self.getId(vertex))
+        guards = {self.getId(rule): rule for rule in element.iter('ownedRule') if self.getId(rule) is not None}
+        for transition in element.iter('transition'):
+            source_id, target_id, guard_id = transition.get('source'), transition.get('target'), transition.get('guard')
+            if source_id in states and target_id in states:
+                self.checkAttributes(transition, ('xmi:id',), diagnostics)
+                if guard_id not in guards or next(guards[guard_id].iter('specification'), None) is None:
+                    diagnostics.append(self.diagnostic('error', 'err7', transition, self.getId(transition)))
+            else:
+                diagnostics.append(self.diagnostic('error', 'err8', transition, source_id))
+        return diagnostics
+
+    def checkInstance(self, element):
+        if element.get('classifier') is None:
+            self.error('err14', element)
+            return
+        slots = [(slot.get('definingFeature'), slot, next(slot.iter('value'), None) is not None) for slot in element.iterchildren('slot')]
+        self.instances.append((element.get('classifier'), self.getId(element), element.sourceline, [(feature, self.getId(slot), slot.sourceline, has_value) for feature, slot, has_value in slots]))
+
+    # Checks needing the whole file: block counts, type references and instances (only instantiated when there is one global block).
+    def finish(self):
+        for scope, code in [('global', 'err9'), ('experiment', 'err13')]:
+            if self.class_counts[scope] > 1:
+                package_id, line = self.scopes[scope]
+                self.diagnostics.append((line, 'error', code, package_id, error_codes[code]()))
+        for scope, type_id, name, element_id, line in self.types:
+            if type_id not in self.enumeration_ids[scope] and type_id not in self.class_names[scope]:
+                self.diagnostics.append((line, 'error', 'err3', element_id, error_codes['err3'](type_id, name)))
+        if self.class_counts['global'] == 1:
+            for classifier, instance_id, line, slots in self.instances:
+                if classifier not in self.model_class_ids:
+                    self.diagnostics.append((line, 'error', 'err11', instance_id, error_codes['err11'](classifier)))
+                for feature, slot_id, slot_line, has_value in slots:
+                    if not has_value:
+                        self.diagnostics.append((slot_line, 'error', 'err10', slot_id, error_codes['err10'](slot_id)))
+                    elif feature not in self.model_attribute_ids:
+                        self.diagnostics.append((slot_line, 'error', 'err12', slot_id, error_codes['err12'](feature)))
+        self.diagnostics.sort(key=lambda diagnostic: diagnostic[0] if diagnostic[0] is not None else 0)
+        return self.diagnostics
+
+@profiled('check')
+def checkModel(xmi_file_path, json_file_path):
+    from lxml import etree
+    diagnostics = []
+    operations = {}
+    for file_path in [xmi_file_path, json_file_path]:
+        if not path.exists(file_path):
+            diagnostics.append((None, 'error', 'err1', None, error_codes['err1'](file_path)))
+    if diagnostics and not path.exists(xmi_file_path):
+        return diagnostics
+    if path.exists(json_file_path):
+        with codecs.open(json_file_path, 'r', encoding='utf-8') as fin:
+            operations = json.load(fin)
+    checker = ModelChecker(operations)
+    try:
+        for event, item in etree.iterparse(xmi_file_path, events=('start-ns', 'start', 'end'), tag='packagedElement', remove_comments=True, huge_tree=True):
+            if event == 'start':
+                checker.start(item)
+            elif event == 'end':
+                checker.end(item)
+            else: # Namespaces are known by their URI, whatever their prefix.
+                if getCanonicalPrefix(item[1]) == 'xmi':
+                    checker.xmi_namespace = item[1]
+                checker.type_prefixes.update(getTypePrefixes({item[0]: item[1]}))
+    except etree.XMLSyntaxError as exception: # Not a transformation diagnostic: reported without code.
+        return diagnostics + [(exception.lineno, 'error', None, None, str(exception))]
+    profiler.count('diagnostics', len(checker.diagnostics))
+    return diagnostics + checker.finish()
+
+def writeDiagnostics(fout, xmi_file_path, diagnostics, output_format = 'text'):
+    counts = {severity: sum(1 for diagnostic in diagnostics if diagnostic[1] == severity) for severity in ['error', 'warning']}
+    if output_format == 'json':
+        fout.write(json.dumps({'file': xmi_file_path, 'errors': counts['error'], 'warnings': counts['warning'], 'diagnostics': [{'line': line, 'severity': severity, 'code': code, 'element_id': element_id, 'message': message} for line, severity, code, element_id, message in diagnostics]}, indent=4))
+        fout.write('\n')
+        return
+    for line, severity, code, element_id, message in diagnostics:
+        location = f'{xmi_file_path}:{line}' if line is not None else xmi_file_path
+        fout.write(f'{location}: {severity} {code or "xml"}{f" ({element_id})" if element_id else ""}: {message}\n')
+    fout.write(f'{xmi_file_path}: {counts["error"]} error(s), {counts["warning"]} warning(s)\n')
+
 # State diagram.
 class UmlState:
+    __slots__ = ('state_id', 'name', 'initial', 'final', 'actions', 'transitions')
     initial_state_name = 'EntryPoint'
     final_state_name   = 'FinalPoint'
 
@@ -310,8 +1854,7 @@ class UmlState:
         elif self.name == UmlState.final_state_name:
             self.final = True
     
-    def translateToGaml(self):
-        template = Template('''
+    template = '''
     state {{ name }}{% if initial %} initial: true{% elif final %} final: true{% endif %} {
         {% for action in actions %}
         do {{ action }}();
@@ -328,10 +1871,13 @@ class UmlState:
         {% endif %}
         {% endfor %}
     }
-        ''', trim_blocks=True, lstrip_blocks=True)
-        return template.render(**self.__dict__).strip()
+        '''
+
+    def translateToGaml(self):
+        return getTemplate('UmlState').render(getContext(self)).strip()
 
 class UmlStateTransition:
+    __slots__ = ('transition_id', 'next_state', 'actions', 'condition')
     def __init__(self, root):
         self.transition_id = getAttributeValue(root, 'xmi:id')
         self.next_state = None
@@ -340,6 +1886,7 @@ class UmlStateTransition:
 
 # Uml class.
 class UmlClass:
+    __slots__ = ('class_id', 'name', 'type', 'parent', 'attributes', 'operations', 'controllers', 'states', 'properties', 'heading')
     enum_default_type = 'int'
     type_conversion = {
         'String'        : 'string',
@@ -349,6 +1896,7 @@ class UmlClass:
     }
     object_type = 'object_type'
     protected_facets = ['object_type', 'skills'] # Theses properties are specific during the getHeading() function.
+    excluded_properties = tuple(protected_facets) + ('uuid',) # A tuple: part of the heading cache key.
 
     def __init__(self, root):
         self.class_id = getAttributeValue(root, 'xmi:id')
@@ -357,24 +1905,24 @@ class UmlClass:
         self.parent = None
         self.attributes = []
         self.operations = []
-        self.controllers = []
+        self.controllers = [] # Rendered states.
+        self.states = [] # UmlState of each rendered state (model diff).
         self.properties = None
         self.heading = None
 
     def getHeading(self):
-        headings = ['%s: %s' % (property, self.properties[property]) for property in self.properties if not property in UmlClass.protected_facets and property != 'uuid']
+        headings = [getPropertyHeading(self.properties, UmlClass.excluded_properties)]
         if len(self.controllers) > 0:
             headings.append('control: fsm')
         if 'skills' in self.properties:
             headings.append('skills: [%s]' % self.properties['skills'])
-        self.heading = ' '.join(headings)
+        self.heading = ' '.join(filter(None, headings))
 
     def getType(self):
         if UmlClass.object_type in self.properties:
             self.type = self.properties[UmlClass.object_type]
 
-    def translateToGaml(self):
-        template = Template('''
+    template = '''
 {% if type %}{{ type }} {% else %}species {% endif %}{{ name }} {% if parent %}parent: {{ parent }} {% endif %}{% if heading %}{{ heading }} {% endif %}{
     {# ---------- Attributes ---------- #}
     {% for attribute in attributes %}
@@ -393,10 +1941,17 @@ class UmlClass:
     {{ controller }}
     {% endfor %}
 }
-        ''', trim_blocks=True, lstrip_blocks=True)
-        return template.render(**self.__dict__)
+        '''
+
+    def translateToGaml(self):
+        return getTemplate('UmlClass').render(getContext(self))
+
+    def generateGaml(self):
+        return getTemplate('UmlClass').generate(getContext(self))
 
 class UmlAttribute:
+    __slots__ = ('attribute_id', 'name', 'visibility', 'is_static', 'type', 'is_list', 'default_value', 'properties', 'heading')
+    template_fields = ('name', 'type', 'is_list', 'default_value', 'heading') # Slots used by the template.
     def __init__(self, root):
         self.attribute_id = getAttributeValue(root, 'xmi:id')
         self.name = getAttributeValue(root, 'name')
@@ -409,26 +1964,29 @@ class UmlAttribute:
         self.heading = None
 
     def getHeading(self):
-        self.heading = ' '.join(['%s: %s' % (key, self.properties[key]) for key in self.properties if key != 'uuid'])
+        self.heading = getPropertyHeading(self.properties, ('uuid',))
 
-    def translateToGaml(self):
-        template = Template('''
+    template = '''
     {% if is_list %}
     list<{{ type }}> {{ name }}{% if default_value is string and default_value != '' %} <- {{ default_value }}{% elif default_value is iterable and default_value|length() > 0 %} <- [{{ default_value|join(', ') }}]{% endif %}{% if heading %} {{ heading }}{% endif %};
     {% else %}
     {{ type }} {{ name }}{% if default_value != None %} <- {{ default_value }}{% endif %}{% if heading %} {{ heading }}{% endif %};
     {% endif %}
-    ''', trim_blocks=True, lstrip_blocks=True)
-        return template.render(**self.__dict__).strip()
+    '''
+
+    def translateToGaml(self):
+        return renderInterned('UmlAttribute', self)
 
 class UmlOperation:
+    __slots__ = ('operation_id', 'name', 'parent_name', 'content', 'parameters', 'type', 'is_list', 'properties', 'heading')
+    template_fields = ('name', 'type', 'is_list', 'parameters', 'heading', 'content') # Slots used by the template.
     gaml_operation_name = 'action'
-    gaml_operations = {}
 
     def __init__(self, root):
         self.operation_id = getAttributeValue(root, 'xmi:id')
         self.name = getAttributeValue(root, 'name')
-        self.content = self.getContent(root)
+        self.parent_name = getAttributeValue(root.parent, 'name')
+        self.content = self.getContent()
         self.parameters = None
         self.type = None
         self.is_list = False
@@ -436,21 +1994,20 @@ class UmlOperation:
         self.heading = None
     
     def getHeading(self):
-        self.heading = ' '.join(['%s: %s' % (key, self.properties[key]) for key in self.properties if key != 'uuid'])
+        self.heading = getPropertyHeading(self.properties, ('uuid',))
 
     def getParameters(self, parameters):
         if len(parameters) > 0:
             self.parameters = ', '.join(reduce(lambda acc, curr: acc + [f'{curr[0]} {curr[1]}'], parameters, []))
 
-    def getContent(self, root):
-        parent_tag_name = getAttributeValue(root.parent, 'name')
-        if parent_tag_name in UmlOperation.gaml_operations and self.name in UmlOperation.gaml_operations[parent_tag_name]:
-            return UmlOperation.gaml_operations[parent_tag_name][self.name]
-        elif len(UmlOperation.gaml_operations) > 0:
-            raiseWarning('warn3', self.name, parent_tag_name)
+    def getContent(self): # Operation bodies of the running transformation.
+        operations = thread_state.operations
+        if self.parent_name in operations and self.name in operations[self.parent_name]:
+            return operations[self.parent_name][self.name]
+        elif len(operations) > 0:
+            raiseWarning('warn3', self.name, self.parent_name)
     
-    def translateToGaml(self):
-        template = Template('''
+    template = '''
     {% if name == 'init' %}
     {{ name}} {
     {% elif is_list %}
@@ -460,24 +2017,27 @@ class UmlOperation:
     {% endif %}
         {{ content }}
     }
-    ''', trim_blocks=True, lstrip_blocks=True)
-        return template.render(**self.__dict__).strip()
+    '''
+
+    def translateToGaml(self):
+        return renderInterned('UmlOperation', self)
 
 # Global part of a gaml file.
 class GamlGlobal:
+    __slots__ = ('name', 'attributes', 'operations', 'instances', 'init', 'sidecars')
     def __init__(self, attributes, operations):
         self.name = 'global'
         self.attributes = attributes
         self.operations = operations
-        self.init = []
+        self.instances = [] # InstanceTable (or compacted GamlInstance), rendered while the global block is written.
+        self.init = None # Content of the init operation.
+        self.sidecars = {} # Csv files of the compacted instances.
 
     def initCompletion(self):
         init_operation = list(filter(lambda operation: operation.name == 'init', self.operations))
-        if len(init_operation) == 1:
-            self.init = self.init + [init_operation[0].content]
+        self.init = init_operation[0].content if len(init_operation) == 1 else None
 
-    def translateToGaml(self):
-        template = Template('''
+    template = '''
 global {
     {# ---------- Instanciate all attributes ---------- #}
     {% for attribute in attributes %}
@@ -486,11 +2046,14 @@ global {
     {% endif %}
     {% endfor %}
 
-    {% if init|length() > 0 %}
+    {% if instances|length() > 0 or init is not none %}
     init {
-    {% for instance in init %}
+    {% for instance in instances %}
         {{ instance }}
     {% endfor %}
+    {% if init is not none %}
+        {{ init }}
+    {% endif %}
     }
     {% endif %}
 
@@ -501,33 +2064,144 @@ global {
     {% endif %}
     {% endfor %}
 }
-''', trim_blocks=True, lstrip_blocks=True)
-        return template.render(**self.__dict__)
+'''
+
+    def translateToGaml(self):
+        return getTemplate('GamlGlobal').render(getContext(self))
+
+    def generateGaml(self):
+        return getTemplate('GamlGlobal').generate(getContext(self))
 
 class GamlInstance:
+    __slots__ = ('class_id', 'name', 'attributes', 'features', 'properties', 'heading')
     package_name = 'instanciation'
     protected_facets = ['priority'] # Theses properties are specific during the getHeading() function.
+    excluded_properties = tuple(protected_facets) + ('uuid',)
 
     def __init__(self):
+        self.class_id = None
         self.name = None
         self.attributes = {}
+        self.features = {} # Attribute name -> defining feature id.
         self.properties = None
         self.heading = None
     
     def getHeading(self):
-        self.heading = ' '.join(['%s: %s' % (property, self.properties[property]) for property in self.properties if not property in GamlInstance.protected_facets and property != 'uuid'])
+        self.heading = getPropertyHeading(self.properties, GamlInstance.excluded_properties)
 
-    def translateToGaml(self):
-        template = Template('''
+    template = '''
         create {{ name }}{% if heading %} {{ heading }}{% endif %} {
             {% for key in attributes %}
             {{ key }} <- {{ attributes[key] }};
             {% endfor %}
         }
-        ''', trim_blocks=True, lstrip_blocks=True)
-        return template.render(**self.__dict__)
+        '''
+
+    def translateToGaml(self):
+        return getTemplate('GamlInstance').render(getContext(self))
+
+    def __str__(self): # Instances of the init block are rendered lazily.
+        return self.translateToGaml()
+
+# Columnar table of the instances: the rows keep the document order, the creation order is a stable argsort of the priority column.
+# The slot values are stored by column for each layout (class and ordered slot features) and each layout owns its format string.
+class InstanceTable:
+    __slots__ = ('instance_ids', 'class_ids', 'class_names', 'class_indexes', 'classes', 'priorities', 'headings', 'properties', 'layouts', 'layout_rows', 'layout_keys', 'layout_indexes', 'layout_sizes', 'columns', 'formats', 'order')
+
+    def __init__(self):
+        self.instance_ids = []
+        self.class_ids = []
+        self.class_names = []
+        self.class_indexes = {} # Class id -> class index.
+        self.classes = array('i') # Class index of each row.
+        self.priorities = array('d')
+        self.headings = []
+        self.properties = []
+        self.layouts = array('i') # Layout index of each row.
+        self.layout_rows = array('i') # Position of each row in the columns of its layout.
+        self.layout_keys = [] # (class index, ((attribute name, feature id), ...)).
+        self.layout_indexes = {} # (class id, feature ids) -> layout index.
+        self.layout_sizes = [] # Number of rows of each layout.
+        self.columns = [] # Slot value columns of each layout.
+        self.formats = [] # (create statement, slots format) of each layout.
+        self.order = array('i')
+
+    def addRow(self, instance_id, uml_class, properties, attributes, features):
+        layout_key = (uml_class.class_id, tuple(features.values())) # The attribute names follow from the features.
+        layout = self.layout_indexes.get(layout_key)
+        if layout is None:
+            layout = self.addLayout(layout_key, uml_class, attributes, features)
+        self.instance_ids.append(instance_id)
+        self.layout_rows.append(self.layout_sizes[layout])
+        self.layout_sizes[layout] += 1
+        for column, value in zip(self.columns[layout], attributes.values()):
+            column.append(value)
+        self.classes.append(self.layout_keys[layout][0])
+        self.priorities.append(float(properties['priority']) if 'priority' in properties else float('inf'))
+        self.headings.append(getPropertyHeading(properties, GamlInstance.excluded_properties))
+        self.properties.append(properties)
+        self.layouts.append(layout)
+
+    def addLayout(self, layout_key, uml_class, attributes, features):
+        class_index = self.class_indexes.get(uml_class.class_id)
+        if class_index is None:
+            class_index = self.class_indexes[uml_class.class_id] = len(self.class_ids)
+            self.class_ids.append(uml_class.class_id)
+            self.class_names.append(uml_class.name)
+        layout = self.layout_indexes[layout_key] = len(self.layout_keys)
+        self.layout_keys.append((class_index, tuple(features.items())))
+        self.layout_sizes.append(0)
+        self.columns.append([[] for _ in attributes])
+        self.formats.append(self.getFormat(uml_class.name, attributes))
+        return layout
+
+    # Same output as the GamlInstance template.
+    @staticmethod
+    def getFormat(name, attributes):
+        slots = ''.join('            %s <- %%s;\n' % key.replace('%', '%%') for key in attributes)
+        return '\n        create ' + name, ' {\n' + slots + '        }\n        '
+
+    def sort(self):
+        self.order = array('i', sorted(range(len(self.classes)), key=self.priorities.__getitem__))
+
+    def __len__(self):
+        return len(self.classes)
+
+    def __iter__(self): # Formatted one row at a time, the slot values stay in their columns.
+        for row in self.order:
+            yield self.formatRow(row)
+
+    def formatRow(self, row):
+        layout = self.layouts[row]
+        create, slots = self.formats[layout]
+        heading = self.headings[row]
+        return (create + ' ' + heading if heading else create) + slots % tuple(column[self.layout_rows[row]] for column in self.columns[layout])
+
+    # Class, heading and slot values of a row (model diff).
+    def getRowKey(self, row):
+        layout = self.layouts[row]
+        class_index, slots = self.layout_keys[layout]
+        return self.class_ids[class_index], self.headings[row], slots, tuple(column[self.layout_rows[row]] for column in self.columns[layout])
+
+    # GamlInstance objects in the creation order (compaction).
+    def instances(self):
+        instances = []
+        for row in self.order:
+            layout = self.layouts[row]
+            class_index, slots = self.layout_keys[layout]
+            instance = GamlInstance()
+            instance.class_id = self.class_ids[class_index]
+            instance.name = self.class_names[class_index]
+            instance.properties = self.properties[row]
+            instance.heading = self.headings[row]
+            for (name, feature_id), column in zip(slots, self.columns[layout]):
+                instance.attributes[name] = column[self.layout_rows[row]]
+                instance.features[name] = feature_id
+            instances.append(instance)
+        return instances
 
 class GamlExperiment:
+    __slots__ = ('name', 'attributes', 'operations', 'properties', 'heading')
     def __init__(self, name, attributes, operations, properties):
         self.name = name
         self.attributes = attributes
@@ -539,8 +2213,7 @@ class GamlExperiment:
         if 'type' in self.properties:
             self.heading = 'type: %s' % (self.properties['type'])
 
-    def translateToGaml(self):
-        template = Template('''
+    template = '''
 experiment {{ name }}{% if heading %} {{ heading }} {% endif %} {
     {# ---------- Instanciate all attributes ---------- #}
     {% for attribute in attributes %}
@@ -563,9 +2236,83 @@ experiment {{ name }}{% if heading %} {{ heading }} {% endif %} {
     }
     {% endif %}
 }
-''', trim_blocks=True, lstrip_blocks=True)
-        return template.render(**self.__dict__)
+'''
+
+    def translateToGaml(self):
+        return getTemplate('GamlExperiment').render(getContext(self))
+
+    def generateGaml(self):
+        return getTemplate('GamlExperiment').generate(getContext(self))
+
+
+# Transformer session.
+# The template environment, the compiled templates and the type caches are shared by the transformations of a session and kept warm between them;
+# a transformation binds the session and its operation bodies to the current thread, so one session can serve concurrent transformations from several threads.
+class Transformer:
+    def __init__(self, operations = None, parser = 'stream', template_cache_directory = None):
+        self.operations = readOperations(operations) if operations is not None else {} # Default operation bodies.
+        self.parser = parser
+        self.template_cache_directory = template_cache_directory
+        self.template_environment = None
+        self.compiled_templates = {}
+        self.href_types = {} # Href of a primitive type -> gaml type.
+        self.lock = threading.RLock() # Template compilation.
+
+    def configureTemplates(self, cache_directory = None):
+        from jinja2 import Environment, DictLoader, FileSystemBytecodeCache
+        bytecode_cache = None
+        if cache_directory:
+            os.makedirs(cache_directory, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_directory)
+        with self.lock:
+            self.template_cache_directory = cache_directory
+            self.template_environment = Environment(loader=DictLoader(getTemplateSources()), bytecode_cache=bytecode_cache, auto_reload=False, trim_blocks=True, lstrip_blocks=True)
+            self.compiled_templates = {}
+        thread_state.fragment_cache.clear()
+        return self.template_environment
+
+    def getTemplateEnvironment(self):
+        with self.lock:
+            return self.template_environment if self.template_environment is not None else self.configureTemplates(self.template_cache_directory)
+
+    def getTemplate(self, name):
+        template = self.compiled_templates.get(name)
+        if template is None:
+            with self.lock:
+                template = self.compiled_templates.get(name)
+                if template is None:
+                    profiler.count('template compilations')
+                    template = self.compiled_templates[name] = self.getTemplateEnvironment().get_template(name)
+        return template
 
+    # Gaml code of a XMI document (bytes), with the operation bodies given as a dictionary or as json (the default ones of the session otherwise).
+    def transform(self, xmi_bytes, operations = None, model_name = 'model'):
+        previous_transformer, previous_operations = thread_state.transformer, thread_state.operations
+        thread_state.transformer = self
+        thread_state.operations = readOperations(operations) if operations is not None else self.operations
+        try:
+            model = buildModel(loadXmi(xmi_bytes, self.parser))
+            releaseXmi() # The model holds only plain data.
+            output = io.StringIO()
+            streamGaml(output, model_name, *model)
+            return output.getvalue()
+        finally:
+            releaseXmi()
+            clearFragmentCaches()
+            thread_state.transformer, thread_state.operations = previous_transformer, previous_operations
+
+# Session of the command line and of the worker processes.
+default_transformer = Transformer()
+
+# Argument type of the numbers of workers, jobs and queued models, which must be at least 1.
+def positiveInt(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid int value: {value!r}')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} must be at least 1')
+    return number
 
 if __name__== "__main__":
     start_time = time.time()
@@ -574,7 +2321,80 @@ if __name__== "__main__":
     parser.add_argument('--example', type=int, default=1, choices=range(1,3), help='Run an example 1 to run prey/predator and 2 to run Luneray\'s flu.')
     parser.add_argument('-f', '--file', type=str, help='Name of xmi and json files on data/gama and data/models repositories.')
     parser.add_argument('-j', '--json', type=str, help='Build the json file according to the XMI file.')
+    parser.add_argument('-b', '--batch', type=str, help='Directory or glob pattern of XMI files to transform into outputs/<model_name>.gaml.')
+    parser.add_argument('-w', '--workers', type=positiveInt, help='Number of worker processes of the batch mode (default: number of CPUs).')
+    parser.add_argument('--pipeline', action='store_true', help='Batch mode as an asynchronous pipeline: prefetch the files, transform them in the worker processes and write the outputs concurrently.')
+    parser.add_argument('--queue-size', type=positiveInt, default=4, help='Number of models waiting between two stages of the pipeline.')
+    parser.add_argument('--diff', type=str, nargs=2, metavar=('OLD_XMI', 'NEW_XMI'), help='Write the changed species, attributes, operations, states and instances between two revisions of a XMI file (standard output unless -o is given), exit status 1 when they differ.')
+    parser.add_argument('--check', type=str, nargs='?', const='text', choices=['text', 'json'], help='Only validate the XMI file (no rendering): every error and warning with its code, element id and line, as text or json (standard output unless -o is given), exit status 1 on errors, 2 when the model can\'t be checked.')
+    parser.add_argument('--json-dir', type=str, help='Directory of the json files of the batch and diff modes (default: next to the XMI file or on ../gama).')
+    parser.add_argument('-o', '--output', type=str, help='Gaml file to write (default: outputs/gen_src.gaml, the standard output for --diff and --check), - for the standard output.')
+    parser.add_argument('--jobs', type=positiveInt, help='Number of worker processes rendering the blocks of a model (default: rendered in the main process).')
+    parser.add_argument('-c', '--compact-instances', action='store_true', help='Collapse the instances of a same class into number: / csv file creations.')
+    parser.add_argument('-i', '--incremental', action='store_true', help='Render again only the blocks whose inputs changed since the last run (hash manifest next to the output).')
+    parser.add_argument('--watch', action='store_true', help='Keep the model in memory and regenerate the gaml file each time the XMI or the json file changes.')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='Seconds between two checks of the watched files.')
+    parser.add_argument('--debounce', type=float, default=0.1, help='Seconds without modification before regenerating in watch mode.')
+    parser.add_argument('--profile', action='store_true', help='Print the time of each phase and the counters of the run.')
+    parser.add_argument('--trace-json', type=str, help='Write the phases and counters of the run as a Chrome trace event file.')
+    parser.add_argument('--cprofile', type=str, help='Run under cProfile and dump the statistics to this .pstats file.')
+    parser.add_argument('--cache-dir', type=str, default='.cache/models', help='Directory of the cache of the built models.')
+    parser.add_argument('--cache-size', type=int, default=256, help='Size limit of the model cache in MB, the least recently used models are evicted.')
+    parser.add_argument('--no-cache', action='store_true', help='Always parse the XMI file, without reading or writing the model cache.')
+    parser.add_argument('-t', '--template-cache', type=str, help='Directory used to cache the compiled templates as bytecode between runs.')
+    parser.add_argument('-p', '--parser', type=str, default='stream', choices=['stream', 'bs4', 'lxml'], help='XMI parser backend: stream (lxml iterparse), lxml (lxml tree and XPath queries) or bs4 (BeautifulSoup fallback).')
     args = parser.parse_args()
+    if args.output == '-' and (args.incremental or args.watch):
+        parser.error('--incremental and --watch need an output file')
+    if args.pipeline and (not args.batch or args.incremental):
+        parser.error('--pipeline is a batch mode without --incremental')
+    if args.check and (args.batch or args.diff or args.incremental or args.watch or args.json):
+        parser.error('--check validates a single XMI file without --batch, --diff, --incremental, --watch or --json')
+    if args.diff and (args.batch or args.incremental or args.watch or args.compact_instances):
+        parser.error('--diff compares two XMI files without --batch, --incremental, --watch or --compact-instances')
+    if args.jobs and args.batch:
+        parser.error('--jobs renders the blocks of a single model, use --workers in batch mode')
+
+    output_file_path = args.output if args.output else '-' if args.diff or args.check else 'outputs/gen_src.gaml' # Reports go to the standard output by default.
+    profiler.enabled = bool(args.profile or args.trace_json)
+    if args.cprofile:
+        import cProfile
+        function_profiler = cProfile.Profile()
+        function_profiler.enable()
+
+    # Reports of the run, written on every exit (batch, diff and check modes exit with their status).
+    def reportProfiles(report_file):
+        if args.cprofile:
+            function_profiler.disable()
+            function_profiler.dump_stats(args.cprofile)
+        if args.profile:
+            print(profiler.summary(), file=report_file)
+        if args.trace_json:
+            profiler.writeTrace(args.trace_json)
+    atexit.register(reportProfiles, sys.stderr if output_file_path == '-' else sys.stdout)
+
+    if args.template_cache:
+        configureTemplates(args.template_cache)
+    cache_directory = None if args.no_cache else args.cache_dir
+    cache_size = args.cache_size * 2**20
+
+    if args.batch:
+        if args.pipeline:
+            results = transformPipeline(findModels(args.batch, 'outputs', args.json_dir), args.workers, args.parser, args.compact_instances, cache_directory, cache_size, args.queue_size)
+        else:
+            results = transformBatch(findModels(args.batch, 'outputs', args.json_dir), args.workers, args.parser, args.compact_instances, args.incremental, cache_directory, cache_size)
+        printBatchSummary(results)
+        print(f'batch executed in {round(time.time() - start_time, 3)} seconds ({round(len(results) / (time.time() - start_time), 1)} models/s).')
+        sys.exit(1 if any(result[2] for result in results) else 0)
+
+    if args.diff: # Exit status 1 when the models differ, 2 when they can't be compared.
+        try:
+            differences = diffModel(*args.diff, output_file_path, args.json_dir, args.parser, cache_directory, cache_size)
+        except Exception as exception:
+            print(f'diff failed: {type(exception).__name__}: {exception}', file=sys.stderr)
+            sys.exit(2)
+        print(f'diff executed in {round(time.time() - start_time, 3)} seconds.', file=sys.stderr if output_file_path == '-' else sys.stdout)
+        sys.exit(1 if differences else 0)
 
     if args.file or args.json:
         file_name = args.file if args.file else args.json
@@ -590,39 +2410,31 @@ if __name__== "__main__":
         json_file_path   = 'data/gama/luneray.json'
         model_name = 'luneray_flu'
 
-    if path.exists(xmi_file_path):
-        with codecs.open(xmi_file_path, 'r', encoding='utf-8') as fin:
-            xml_tree = bs4.BeautifulSoup(fin, 'xml')
-    else:
-        raiseException('err1', xmi_file_path)
-    
-    if not args.json:
-        if path.exists(json_file_path):
-            with codecs.open(json_file_path, 'r', encoding='utf-8') as fin:
-                UmlOperation.gaml_operations = json.load(fin)
+    if args.check: # Exit status 1 when the model has errors, 2 when it can't be checked.
+        try:
+            diagnostics = checkModel(xmi_file_path, json_file_path)
+        except Exception as exception:
+            print(f'check failed: {type(exception).__name__}: {exception}', file=sys.stderr)
+            sys.exit(2)
+        if output_file_path == '-':
+            writeDiagnostics(sys.stdout, xmi_file_path, diagnostics, args.check)
         else:
-            raiseException('err1', json_file_path)
+            with codecs.open(output_file_path, 'w', encoding='utf-8') as fout:
+                writeDiagnostics(fout, xmi_file_path, diagnostics, args.check)
+        print(f'{model_name} checked in {round(time.time() - start_time, 3)} seconds.', file=sys.stderr)
+        sys.exit(1 if any(diagnostic[1] == 'error' for diagnostic in diagnostics) else 0)
 
-    # Meta model package.
-    uml_classes = buildClassDiagram(xml_tree, 'meta_model')
-    uml_global = getGlobal(xml_tree, uml_classes)
-    uml_experiment = getExperiment(xml_tree)
+    if args.watch:
+        try:
+            watchModel(xmi_file_path, json_file_path, model_name, output_file_path, args.parser, args.compact_instances, args.poll_interval, args.debounce)
+        except KeyboardInterrupt:
+            sys.exit(0)
 
     if args.json:
         with codecs.open(f'data/gama/{model_name}.json', 'w', encoding='utf-8') as fout:
-            json_file = buildJsonFileSkeleton(uml_classes, uml_global, uml_experiment)
+            json_file = scanJsonFileSkeleton(loadXmi(xmi_file_path, args.parser))
             fout.write(json.dumps(json_file, indent=4))
     else:
-        output_file_path = 'outputs/gen_src.gaml'
-        with codecs.open(output_file_path, 'w', encoding='utf-8') as fout:
-            fout.write(f'model {model_name}\n')
-            if uml_global:
-                fout.write(uml_global.translateToGaml() + '\n')
-            if uml_experiment:
-                fout.write(uml_experiment.translateToGaml() + '\n')
-            for uml_class in uml_classes:
-                fout.write(uml_class.translateToGaml() + '\n')
+        transformModel(xmi_file_path, json_file_path, model_name, output_file_path, args.parser, args.compact_instances, args.incremental, args.jobs, cache_directory, cache_size)
     
-    print(f'{model_name} executed in {round(time.time() - start_time, 3)} seconds.')
-
-    
\ No newline at end of file
+    print(f'{model_name} executed in {round(time.time() - start_time, 3)} seconds.', file=sys.stderr if output_file_path == '-' else sys.stdout)